@@ -5,9 +5,12 @@ from node.ext.ldap.scope import SUBTREE
 from node.ext.ldap.base import LDAPCommunicator
 from node.ext.ldap.base import LDAPConnector
 from node.ext.ldap.base import testLDAPConnectivity
+from node.ext.ldap.session import LDAPAsyncSession
 from node.ext.ldap.session import LDAPSession
 from node.ext.ldap._node import LDAPNode
 from node.ext.ldap._node import LDAPNodeAttributes
+from node.ext.ldap._node import LDAPReadOnlyNode
+from node.ext.ldap._node import LDAPReadOnlyNodeAttributes
 from node.ext.ldap._node import LDAPStorage
 from node.ext.ldap.filter import LDAPDictFilter
 from node.ext.ldap.filter import LDAPFilter
@@ -23,8 +23,11 @@ from node.ext.ldap.events import LDAPNodeDetachedEvent
 from node.ext.ldap.events import LDAPNodeModifiedEvent
 from node.ext.ldap.events import LDAPNodeRemovedEvent
 from node.ext.ldap.filter import LDAPDictFilter
-from node.ext.ldap.filter import LDAPFilter
 from node.ext.ldap.filter import LDAPRelationFilter
+from node.ext.ldap.filter import and_filters
+from node.ext.ldap.filter import filter_matcher
+from node.ext.ldap.filter import split_filter
+from node.ext.ldap.interfaces import ILDAPReadOnly
 from node.ext.ldap.interfaces import ILDAPStorage
 from node.ext.ldap.schema import LDAPSchemaInfo
 from node.interfaces import IInvalidate
@@ -35,8 +38,10 @@ from node.utils import encode
 from plumber import Behavior
 from plumber import default
 from plumber import finalize
+from plumber import override
 from plumber import plumb
 from plumber import plumbing
+from zope.component.event import objectEventNotify
 from zope.deprecation import deprecated
 from zope.interface import implementer
 
@@ -46,11 +51,23 @@ ACTION_MODIFY = 1
 ACTION_DELETE = 2
 
 
+class _MergedCookie(str):
+    # paging cookie of search over merged results of filter chunks or of a
+    # snapshot. Value is the offset of the next page, ``matches`` are the
+    # merged results paged over
+    matches = None
+
+
 class LDAPAttributesBehavior(Behavior):
 
     @plumb
     def __init__(_next, self, name=None, parent=None):
         _next(self, name=name, parent=parent)
+        # attribute values as persisted in the directory
+        self._original = None
+        # values added and removed by ``add_value`` and ``remove_value``
+        # since snapshot as dict of key -> (added, removed)
+        self._journal = None
         self.load()
 
     @default
@@ -74,26 +91,33 @@ class LDAPAttributesBehavior(Behavior):
         # if self.session._props.memberOfSupport:
         #    attrlist.append('memberOf')
 
-        # fetch attributes for ldap_node
-        entry = ldap_node.ldap_session.search(
-            scope=BASE,
-            baseDN=ldap_node.DN.encode('utf-8'),
-            force_reload=ldap_node._reload,
-            attrlist=attrlist,
-        )
-        # result length must be 1
-        if len(entry) != 1:
-            raise RuntimeError(                            # pragma NO COVERAGE
-                u"Fatal. Expected entry does not exist "   # pragma NO COVERAGE
-                u"or more than one entry found"            # pragma NO COVERAGE
-            )                                              # pragma NO COVERAGE
-        # read attributes from result and set to self
-        attrs = entry[0][1]
+        # attributes already fetched while iterating parent
+        attrs = ldap_node._prefetched_attrs
+        if attrs is not None:
+            ldap_node._prefetched_attrs = None
+        else:
+            # fetch attributes for ldap_node
+            entry = ldap_node.ldap_session.search(
+                scope=BASE,
+                baseDN=ldap_node.DN.encode('utf-8'),
+                force_reload=ldap_node._reload,
+                attrlist=attrlist,
+            )
+            # result length must be 1
+            if len(entry) != 1:
+                raise RuntimeError(                        # pragma NO COVERAGE
+                    u"Fatal. Expected entry does not "     # pragma NO COVERAGE
+                    u"exist or more than one entry found"  # pragma NO COVERAGE
+                )                                          # pragma NO COVERAGE
+            # read attributes from result
+            attrs = entry[0][1]
+        # set attributes to self
         for key, item in attrs.items():
             if len(item) == 1 and not self.is_multivalued(key):
                 self[key] = item[0]
             else:
                 self[key] = item
+        self.snapshot()
         # __setitem__ has set our changed flag. We just loaded from LDAP, so
         # unset it
         self.changed = False
@@ -108,17 +132,131 @@ class LDAPAttributesBehavior(Behavior):
             ldap_node._action = None
             ldap_node.changed = False
 
+    @default
+    def snapshot(self):
+        """Remember current attribute values as persisted state. Used to
+        compute the modification list when modifying the entry.
+        """
+        self._original = dict([
+            (key, isinstance(val, list) and list(val) or val)
+            for key, val in self.items()
+        ])
+        self._journal = None
+
+    @default
+    def add_value(self, key, val):
+        """Add value to multivalued attribute.
+
+        The value list is changed in place and the added value is recorded,
+        thus only this value is written on commit without comparing all
+        values. ``val`` must not be contained yet.
+        """
+        key = decode(key)
+        if self.is_binary(key):
+            # binary values may be shared with cached search results
+            self[key] = self._values(key) + [val]
+            return
+        val = decode(val)
+        values = self.storage.get(key)
+        if not isinstance(values, list):
+            # not set yet or single value
+            self[key] = values is None and [val] or [values, val]
+            return
+        values.append(val)
+        entry = self._journal_entry(key)
+        if entry is not None:
+            added, removed = entry
+            if val in removed:
+                removed.remove(val)
+            else:
+                added.append(val)
+        self._set_values_modified()
+
+    @default
+    def remove_value(self, key, val):
+        """Remove value from multivalued attribute.
+
+        The value list is changed in place and the removed value is
+        recorded, thus only this value is written on commit without
+        comparing all values. Raise ``ValueError`` if value not contained.
+        """
+        key = decode(key)
+        if self.is_binary(key):
+            # binary values may be shared with cached search results
+            values = self._values(key)
+            values.remove(val)
+            self[key] = values
+            return
+        val = decode(val)
+        values = self.storage.get(key)
+        if not isinstance(values, list):
+            # not set or single value
+            if values is None or values != val:
+                raise ValueError(u"Value not contained.")
+            del self[key]
+            return
+        try:
+            values.remove(val)
+        except ValueError:
+            raise ValueError(u"Value not contained.")
+        entry = self._journal_entry(key)
+        if entry is not None:
+            added, removed = entry
+            if val in added:
+                added.remove(val)
+            else:
+                removed.append(val)
+        self._set_values_modified()
+
+    @default
+    def _values(self, key):
+        # return copy of values of key as list
+        values = self.storage.get(key)
+        if values is None:
+            return list()
+        return isinstance(values, list) and list(values) or [values]
+
+    @default
+    def _journal_entry(self, key):
+        # return lists of added and removed values of key since snapshot, or
+        # None if values of key have been set as a whole since snapshot
+        if self._journal is None:
+            self._journal = dict()
+        if key in self._journal:
+            return self._journal[key]
+        entry = self._journal[key] = (list(), list())
+        return entry
+
+    @default
+    def _journal_reset(self, key):
+        # values of key set as a whole, values get compared on commit
+        if self._original is not None and key in self._original:
+            if self._journal is None:
+                self._journal = dict()
+            self._journal[key] = None
+
+    @default
+    def _set_values_modified(self):
+        # values changed in place. Mark modified and notify like setting
+        # attribute does
+        self._set_attrs_modified()
+        ldap_node = self.parent
+        if not ldap_node._notify_suppress:
+            objectEventNotify(ldap_node.events['modified'](ldap_node))
+
     @plumb
     def __setitem__(_next, self, key, val):
         if not self.is_binary(key):
             val = decode(val)
         key = decode(key)
         _next(self, key, val)
+        self._journal_reset(key)
         self._set_attrs_modified()
 
     @plumb
     def __delitem__(_next, self, key):
         _next(self, key)
+        self._journal_reset(key)
         self._set_attrs_modified()
 
     @default
@@ -157,9 +295,9 @@ class LDAPNodeAttributes(NodeAttributes):
 
 @implementer(ILDAPStorage, IInvalidate)
 class LDAPStorage(OdictStorage):
-    attributes_factory = finalize(LDAPNodeAttributes)
+    attributes_factory = override(LDAPNodeAttributes)
 
-    @finalize
+    @override
     def __init__(self, name=None, props=None):
         """LDAP Node expects ``name`` and ``props`` arguments for the root LDAP
         Node or nothing for children.
@@ -184,6 +322,12 @@ class LDAPStorage(OdictStorage):
         self._modified_children = set()
         self._deleted_children = set()
         self._reload = False
+        self._prefetched_attrs = None
+        # keys of children known to exist from the iteration in progress,
+        # mapping to DN if known
+        self._known_children = dict()
+        # flag whether all children are in storage
+        self._children_loaded = False
         self._multivalued_attributes = {}
         self._binary_attributes = {}
         self._page_size = 1000
@@ -203,6 +347,8 @@ class LDAPStorage(OdictStorage):
         # creation related default
         self.child_factory = LDAPNode
         self.child_defaults = None
+        # iteration related default
+        self.prefetch = False
 
     @finalize
     def __getitem__(self, key):
@@ -215,6 +361,17 @@ class LDAPStorage(OdictStorage):
             val = self.child_factory()
             val.__name__ = key
             val.__parent__ = self
+            if key in self._known_children:
+                # child existence already known from iteration or search
+                # result, no need to ask the directory
+                dn = self._known_children.pop(key)
+                val._dn = dn is not None and dn or self.child_dn(key)
+                val._ldap_session = self.ldap_session
+                self.storage[key] = val
+                return val
+            missing_key = ('dn', val.DN.lower())
+            if self.ldap_session.missing(missing_key):
+                raise KeyError(key)
             try:
                 res = self.ldap_session.search(
                     scope=BASE,
@@ -227,12 +384,16 @@ class LDAPStorage(OdictStorage):
                 self.storage[key] = val
                 return val
             except (NO_SUCH_OBJECT, INVALID_DN_SYNTAX):
+                self.ldap_session.set_missing(missing_key)
                 raise KeyError(key)
 
     @finalize
     def __setitem__(self, key, val):
         if isinstance(key, str):
             key = decode(key)
+        if ILDAPReadOnly.providedBy(val) \
+                or ILDAPReadOnly.providedBy(self.storage.get(key)):
+            raise RuntimeError(u"Read only node. Cannot add '%s'." % (key,))
         if not isinstance(val, LDAPNode):
             # create one from whatever we got
             # XXX: raise KeyError instead of trying to create node
@@ -280,6 +441,8 @@ class LDAPStorage(OdictStorage):
             self.changed = False
             return
         val = self[key]
+        if ILDAPReadOnly.providedBy(val):
+            raise RuntimeError(u"Read only node. Cannot delete '%s'." % (key,))
         val._action = ACTION_DELETE
         # this will also trigger the changed chain
         val.changed = True
@@ -289,28 +452,48 @@ class LDAPStorage(OdictStorage):
     def __iter__(self):
         if self.name is None:
             return
+        # fetch children attributes along with keys if prefetch enabled
+        attrlist = self.prefetch and ['*'] or ['']
         cookie = ''
-        while True:
-            try:
-                res = self.ldap_session.search(
-                    scope=ONELEVEL,
-                    baseDN=encode(self.DN),
-                    attrlist=[''],
-                    page_size=self._page_size,
-                    cookie=cookie,
-                )
-            except NO_SUCH_OBJECT:
-                # happens if not persisted yet
-                res = list()
-            if isinstance(res, tuple):
-                res, cookie = res
-            for dn, _ in res:
-                key = decode(explode_dn(dn)[0])
-                # do not yield if node is supposed to be deleted
-                if key not in self._deleted_children:
+        known = list()
+        try:
+            while True:
+                try:
+                    res = self.ldap_session.search(
+                        scope=ONELEVEL,
+                        baseDN=encode(self.DN),
+                        attrlist=attrlist,
+                        page_size=self._page_size,
+                        cookie=cookie,
+                    )
+                except NO_SUCH_OBJECT:
+                    # happens if not persisted yet
+                    res = list()
+                if isinstance(res, tuple):
+                    res, cookie = res
+                for dn, attrs in res:
+                    key = decode(explode_dn(dn)[0])
+                    # do not yield if node is supposed to be deleted
+                    if key in self._deleted_children:
+                        continue
+                    if key not in self.storage:
+                        if self.prefetch:
+                            self._create_prefetched_child(key, dn, attrs)
+                        else:
+                            self._known_children[key] = dn
+                            known.append(key)
                     yield key
-            if not cookie:
-                break
+                if not cookie:
+                    break
+            # all children are in storage if accessed while iterating
+            self._children_loaded = not [
+                key for key in known if key not in self.storage
+            ]
+        finally:
+            # existence of children is trusted during iteration only, the
+            # directory might have changed afterwards
+            for key in known:
+                self._known_children.pop(key, None)
 
         # also yield keys of children not persisted yet.
         for key in self._added_children:
@@ -340,6 +523,111 @@ class LDAPStorage(OdictStorage):
             if node.changed:
                 node()
 
+    @default
+    def batched_commit(self, batch_size=1000):
+        """Write all pending changes of the tree to the directory.
+
+        Other than calling the node, operations are not performed one after
+        another. Pending operations get collected first. Adds and
+        modifications are written parents first, deletions leafs first.
+        Operations of one tree level do not depend on each other, thus they
+        get sent to the server without waiting for each single result.
+
+        batch_size
+            Maximum number of operations sent at once.
+
+        Return list of ``(node, error)`` tuples for failed operations.
+        Children of nodes which failed to be added are not written and
+        reported with a ``RuntimeError``. Failed nodes and their parents keep
+        their changed state.
+        """
+        writes = dict()
+        deletes = dict()
+        self._collect_operations(0, writes, deletes)
+        levels = [writes[depth] for depth in sorted(writes)]
+        levels += [deletes[depth] for depth in sorted(deletes, reverse=True)]
+        failed = list()
+        # ids of nodes not added, their children get skipped
+        unadded = set()
+        for nodes in levels:
+            for i in range(0, len(nodes), batch_size):
+                pending = list()
+                operations = list()
+                for node in nodes[i:i + batch_size]:
+                    if id(node.parent) in unadded:
+                        unadded.add(id(node))
+                        failed.append((node, RuntimeError(
+                            u"Parent '%s' has not been added." % (
+                                node.parent.DN,))))
+                        continue
+                    operation = node._ldap_operation()
+                    if operation is None:
+                        # nothing to write
+                        node._ldap_committed()
+                        continue
+                    pending.append(node)
+                    operations.append(operation)
+                errors = self.ldap_session.write_many(operations)
+                for node, error in zip(pending, errors):
+                    if error is not None:
+                        if node._action == ACTION_ADD:
+                            unadded.add(id(node))
+                        failed.append((node, error))
+                        continue
+                    node._ldap_committed()
+        # parents of failed nodes might have been unset changed while
+        # committing succeeded operations of other children
+        for node, error in failed:
+            parent = node.parent
+            while parent is not None and not parent._changed:
+                parent._changed = True
+                parent = parent.parent
+        return failed
+
+    @default
+    def _collect_operations(self, depth, writes, deletes):
+        # collect changed nodes for batched commit by tree depth
+        if self.changed and self._action is not None:
+            if self._action == ACTION_DELETE:
+                deletes.setdefault(depth, list()).append(self)
+            else:
+                writes.setdefault(depth, list()).append(self)
+        for node in self.storage.values():
+            if node.changed:
+                node._collect_operations(depth + 1, writes, deletes)
+
+    @default
+    def _ldap_operation(self):
+        # write operation of self for batched commit
+        if self._action == ACTION_ADD:
+            return ('add', encode(self.DN), self._ldap_entry())
+        if self._action == ACTION_MODIFY:
+            modlist = self._ldap_modlist()
+            if not modlist:
+                return None
+            return ('modify', encode(self.DN), modlist)
+        return ('delete', encode(self.DN), None)
+
+    @default
+    def _ldap_committed(self):
+        # reset changed state after operation of batched commit succeeded
+        if self._action == ACTION_ADD:
+            self.parent._added_children.remove(self.name)
+            self.attrs.snapshot()
+        elif self._action == ACTION_MODIFY:
+            if self.parent:
+                self.parent._modified_children.remove(self.name)
+            self.attrs.snapshot()
+        elif self._action == ACTION_DELETE:
+            self.parent._deleted_children.remove(self.name)
+            del self.parent.storage[self.name]
+        try:
+            self.nodespaces['__attrs__'].changed = False
+        except KeyError:
+            pass
+        self.changed = False
+        self._action = None
+
     @finalize
     def __repr__(self):
         dn = self.DN.encode('ascii', 'replace') or '(dn not set)'
@@ -434,8 +722,12 @@ class LDAPStorage(OdictStorage):
         return u','.join([decode(key), decode(self.name)])
 
     @default
-    def node_by_dn(self, dn, strict=False):
+    def node_by_dn(self, dn, strict=False, exists=False):
         """Return node from tree by DN.
+
+        If ``exists`` is True, the entry is known to exist in the directory,
+        e.g. because DN has been taken from a search result. Nodes on the
+        path get created without asking the directory for existence.
         """
         root = node = self.root
         base_dn = root.name
@@ -443,6 +735,11 @@ class LDAPStorage(OdictStorage):
             raise ValueError(u'Invalid base DN')
         dn = dn[:len(dn) - len(base_dn)].strip(',')
         for rdn in reversed(explode_dn(encode(dn))):
+            if exists:
+                key = decode(rdn)
+                if key not in node.storage \
+                        and key not in node._deleted_children:
+                    node._known_children.setdefault(key, None)
             try:
                 node = node[rdn]
             except KeyError:
@@ -457,21 +754,123 @@ class LDAPStorage(OdictStorage):
     def search(self, queryFilter=None, criteria=None, attrlist=None,
                relation=None, relation_node=None, exact_match=False,
                or_search=False, or_keys=None, or_values=None,
-               page_size=None, cookie=None, get_nodes=False):
+               page_size=None, cookie=None, get_nodes=False, snapshot=False):
+        _filter = self._search_filter(queryFilter, criteria, relation,
+                                      relation_node, or_search, or_keys,
+                                      or_values)
+        matches = None
+        merged = isinstance(cookie, _MergedCookie)
+        if merged:
+            # continue paging over merged results of previous page
+            if not page_size:
+                raise ValueError(u"Cookie passed without page_size.")
+            matches = cookie.matches
+        elif snapshot:
+            # evaluate filter against nodes in memory. None if nodes within
+            # search scope are not loaded completely
+            matches = self._search_snapshot(_filter)
+        filters = matches is None and self._search_chunks(_filter) or None
+        if matches is not None or len(filters) > 1:
+            if cookie and not merged:
+                raise ValueError(u"Invalid paging cookie.")
+            if matches is None:
+                # perform the backend searches for filter chunks at once.
+                # Each chunk is fetched as a whole
+                matches = self._search_many(filters, attrlist)
+            if page_size:
+                # page over merged results. They are kept on the cookie for
+                # subsequent pages
+                offset = cookie and int(cookie) or 0
+                end = offset + page_size
+                if end < len(matches):
+                    cookie = _MergedCookie(end)
+                    cookie.matches = matches
+                else:
+                    cookie = ''
+                matches = matches[offset:end]
+        else:
+            attrset = set(attrlist or [])
+            attrset.discard('dn')
+            attrset.discard('rdn')
+            # perform the backend search
+            matches = self.ldap_session.search(
+                str(_filter),
+                self.search_scope,
+                baseDN=encode(self.DN),
+                force_reload=self._reload,
+                attrlist=list(attrset),
+                page_size=page_size,
+                cookie=cookie,
+            )
+        if type(matches) is tuple:
+            matches, cookie = matches
+        # check exact match
+        if exact_match and len(matches) > 1:
+            raise ValueError(u"Exact match asked but result not unique")
+        if exact_match and len(matches) == 0:
+            raise ValueError(u"Exact match asked but result length is zero")
+        # extract key and desired attributes
+        res = [
+            self._search_result(dn, attrs, attrlist, get_nodes)
+            for dn, attrs in matches
+        ]
+        if cookie is not None:
+            return (res, cookie)
+        return res
+
+    @default
+    def search_iter(self, queryFilter=None, criteria=None, attrlist=None,
+                    relation=None, relation_node=None, or_search=False,
+                    or_keys=None, or_values=None, page_size=None,
+                    get_nodes=False):
+        """Search generator yielding result items as they are received from
+        the server.
+
+        Accepts the same arguments as ``search`` except ``exact_match`` and
+        ``cookie``. Paging is done internally, ``page_size`` defaults to the
+        page size defined on props. Results are not cached.
+        """
+        if page_size is None:
+            page_size = self.ldap_session._props.page_size
+        _filter = self._search_filter(queryFilter, criteria, relation,
+                                      relation_node, or_search, or_keys,
+                                      or_values)
         attrset = set(attrlist or [])
         attrset.discard('dn')
         attrset.discard('rdn')
+        filters = self._search_chunks(_filter)
+        seen = set()
+        for _filter in filters:
+            matches = self.ldap_session.search_iter(
+                str(_filter),
+                self.search_scope,
+                baseDN=encode(self.DN),
+                attrlist=list(attrset),
+                page_size=page_size,
+            )
+            for dn, attrs in matches:
+                if len(filters) > 1:
+                    # entries may match several filter chunks
+                    if dn in seen:
+                        continue
+                    seen.add(dn)
+                yield self._search_result(dn, attrs, attrlist, get_nodes)
+
+    @default
+    def _search_filter(self, queryFilter, criteria, relation, relation_node,
+                       or_search, or_keys, or_values):
         # Create queryFilter from all filter definitions
         # filter for this search ANDed with the default filters defined on self
-        search_filter = LDAPFilter(queryFilter)
-        search_filter &= LDAPDictFilter(criteria,
-                                        or_search=or_search,
-                                        or_keys=or_keys,
-                                        or_values=or_values,
-                                        )
-        _filter = LDAPFilter(self.search_filter)
-        _filter &= LDAPDictFilter(self.search_criteria)
-        _filter &= search_filter
+        filters = [
+            self.search_filter,
+            LDAPDictFilter(self.search_criteria),
+            queryFilter,
+            LDAPDictFilter(criteria,
+                           or_search=or_search,
+                           or_keys=or_keys,
+                           or_values=or_values,
+                           ),
+        ]
         # relation filters
         if relation_node is None:
             relation_node = self
@@ -480,57 +879,109 @@ class LDAPStorage(OdictStorage):
             if not relation:
                 continue
             if isinstance(relation, LDAPRelationFilter):
-                _filter &= relation
+                filters.append(relation)
             else:
-                _filter &= LDAPRelationFilter(relation_node, relation)
-        # perform the backend search
-        matches = self.ldap_session.search(
-            str(_filter),
-            self.search_scope,
-            baseDN=encode(self.DN),
-            force_reload=self._reload,
-            attrlist=list(attrset),
-            page_size=page_size,
-            cookie=cookie,
-        )
-        if type(matches) is tuple:
-            matches, cookie = matches
-        # check exact match
-        if exact_match and len(matches) > 1:
-            raise ValueError(u"Exact match asked but result not unique")
-        if exact_match and len(matches) == 0:
-            raise ValueError(u"Exact match asked but result length is zero")
-        # extract key and desired attributes
-        res = []
-        for dn, attrs in matches:
-            dn = decode(dn)
-            if attrlist is not None:
-                resattr = dict()
-                for k, v in attrs.iteritems():
-                    if k in attrlist:
-                        # Check binary binary attribute directly from root
-                        # data to avoid initing attrs for a simple search.
-                        if k in self.root._binary_attributes:
-                            resattr[decode(k)] = v
-                        else:
-                            resattr[decode(k)] = decode(v)
-                if 'dn' in attrlist:
-                    resattr[u'dn'] = dn
-                if 'rdn' in attrlist:
-                    rdn = explode_dn(encode(dn))[0]
-                    resattr[u'rdn'] = decode(rdn)
-                if get_nodes:
-                    res.append((self.node_by_dn(dn, strict=True), resattr))
-                else:
-                    res.append((dn, resattr))
-            else:
-                if get_nodes:
-                    res.append(self.node_by_dn(dn, strict=True))
+                filters.append(LDAPRelationFilter(relation_node, relation))
+        return and_filters(*filters)
+
+    @default
+    def _search_chunks(self, _filter):
+        # split filter containing big OR filters into several filters as
+        # configured by ``filter_chunk_size`` on props
+        props = self.ldap_session._props
+        return split_filter(_filter, getattr(props, 'filter_chunk_size', 0))
+
+    @default
+    def _search_many(self, filters, attrlist):
+        # search entries matching any of filters with one request per filter,
+        # all sent at once. Entries matching several filters are returned
+        # once
+        attrset = set(attrlist or [])
+        attrset.discard('dn')
+        attrset.discard('rdn')
+        queries = [{
+            'queryFilter': str(_filter),
+            'scope': self.search_scope,
+            'baseDN': encode(self.DN),
+            'attrlist': list(attrset),
+        } for _filter in filters]
+        results = self.ldap_session.search_many(
+            queries, force_reload=self._reload)
+        matches = list()
+        seen = set()
+        for res in results:
+            if isinstance(res, Exception):
+                raise res
+            for dn, attrs in res:
+                if dn not in seen:
+                    seen.add(dn)
+                    matches.append((dn, attrs))
+        return matches
+
+    @default
+    def _search_snapshot(self, _filter):
+        # search entries of nodes in memory within search scope. Return None
+        # if the snapshot is incomplete, i.e. children of a node within
+        # search scope may be missing in storage or attributes of a node are
+        # not loaded
+        matcher = filter_matcher(_filter)
+        nodes = self.search_scope != ONELEVEL and [self] or []
+        if self.search_scope != BASE:
+            stack = [self]
+            while stack:
+                node = stack.pop()
+                if not node._children_loaded and node._action != ACTION_ADD:
+                    return None
+                children = node.storage.values()
+                nodes.extend(children)
+                if self.search_scope != ONELEVEL:
+                    stack.extend(children)
+        matches = list()
+        for node in nodes:
+            if node.parent is not None \
+                    and node.name in node.parent._deleted_children:
+                continue
+            attrs = node._prefetched_attrs
+            if attrs is None:
+                if '__attrs__' not in node.nodespaces:
+                    # attributes not loaded
+                    return None
+                attrs = dict([
+                    (key, isinstance(val, list) and val or [val])
+                    for key, val in node.attrs.items()
+                ])
+            lowered = dict([
+                (key.lower(), val) for key, val in attrs.items()
+            ])
+            if matcher(lowered):
+                matches.append((encode(node.DN), attrs))
+        return matches
+
+    @default
+    def _search_result(self, dn, attrs, attrlist, get_nodes):
+        # create search result item from LDAP entry
+        dn = decode(dn)
+        if attrlist is None:
+            if get_nodes:
+                return self.node_by_dn(dn, strict=True, exists=True)
+            return dn
+        resattr = dict()
+        for k, v in attrs.iteritems():
+            if k in attrlist:
+                # Check binary binary attribute directly from root
+                # data to avoid initing attrs for a simple search.
+                if k in self.root._binary_attributes:
+                    resattr[decode(k)] = v
                 else:
-                    res.append(dn)
-        if cookie is not None:
-            return (res, cookie)
-        return res
+                    resattr[decode(k)] = decode(v)
+        if 'dn' in attrlist:
+            resattr[u'dn'] = dn
+        if 'rdn' in attrlist:
+            rdn = explode_dn(encode(dn))[0]
+            resattr[u'rdn'] = decode(rdn)
+        if get_nodes:
+            return (self.node_by_dn(dn, strict=True, exists=True), resattr)
+        return (dn, resattr)
 
     @default
     def batched_search(self, page_size=None, search_func=None, **kw):
@@ -574,6 +1025,8 @@ class LDAPStorage(OdictStorage):
                 raise RuntimeError(u"Invalid tree state. Try to invalidate "
                                    u"changed node.")
             self.storage.clear()
+            self._known_children.clear()
+            self._children_loaded = False
             self.attrs.load()
             # XXX: needs to get unset again somwhere
             self._reload = True
@@ -585,8 +1038,22 @@ class LDAPStorage(OdictStorage):
                     u"Invalid tree state. Try to invalidate "
                     u"changed child node '%s'." % (key,))
             del self.storage[key]
+            self._children_loaded = False
         except KeyError:
             pass
+        self._known_children.pop(key, None)
+
+    @default
+    def _create_prefetched_child(self, key, dn, attrs):
+        # create child node from search result. attributes get set on first
+        # access of child attrs
+        val = self.child_factory()
+        val.__name__ = key
+        val.__parent__ = self
+        val._dn = dn
+        val._ldap_session = self.ldap_session
+        val._prefetched_attrs = attrs
+        self.storage[key] = val
 
     @default
     def _create_suitable_node(self, vessel):
@@ -603,18 +1070,34 @@ class LDAPStorage(OdictStorage):
     @default
     def _ldap_add(self):
         # adds self to the ldap directory.
+        self.ldap_session.add(encode(self.DN), self._ldap_entry())
+        self.attrs.snapshot()
+
+    @default
+    def _ldap_entry(self):
+        # entry data of self for adding to the ldap directory.
         attrs = {}
         for key, value in self.attrs.items():
             if not self.attrs.is_binary(key):
                 value = encode(value)
             attrs[encode(key)] = value
-        self.ldap_session.add(encode(self.DN), attrs)
+        return attrs
 
     @default
     def _ldap_modify(self):
         # modifies attributs of self on the ldap directory.
+        modlist = self._ldap_modlist()
+        if modlist:
+            self.ldap_session.modify(encode(self.DN), modlist)
+        self.attrs.snapshot()
+
+    @default
+    def _ldap_modlist(self):
+        # modification list of self against the persisted attributes.
         modlist = list()
-        orgin = self.attributes_factory(name='__attrs__', parent=self)
+        orgin = self.attrs._original
+        if orgin is None:
+            orgin = self.attributes_factory(name='__attrs__', parent=self)
 
         for key in orgin:
             # MOD_DELETE
@@ -629,12 +1112,58 @@ class LDAPStorage(OdictStorage):
             if key not in orgin:
                 moddef = (MOD_ADD, encode(key), value)
                 modlist.append(moddef)
+            # MOD_ADD and MOD_DELETE of values recorded as added and removed
+            elif self.attrs._journal \
+                    and self.attrs._journal.get(key) is not None:
+                modlist += self._ldap_journal_modlist(
+                    key, *self.attrs._journal[key])
+            # MOD_ADD and MOD_DELETE of changed values
+            elif isinstance(self.attrs[key], list) \
+                    or isinstance(orgin[key], list):
+                modlist += self._ldap_values_modlist(
+                    key, orgin[key], self.attrs[key])
             # MOD_REPLACE
             elif self.attrs[key] != orgin[key]:
                 moddef = (MOD_REPLACE, encode(key), value)
                 modlist.append(moddef)
-        if modlist:
-            self.ldap_session.modify(encode(self.DN), modlist)
+        return modlist
+
+    @default
+    def _ldap_journal_modlist(self, key, added, removed):
+        # modifications for values recorded by ``add_value`` and
+        # ``remove_value``
+        if not self.attrs.is_binary(key):
+            added, removed = encode(added), encode(removed)
+        modlist = list()
+        if removed:
+            modlist.append((MOD_DELETE, encode(key), removed))
+        if added:
+            modlist.append((MOD_ADD, encode(key), added))
+        return modlist
+
+    @default
+    def _ldap_values_modlist(self, key, old, new):
+        # modifications for multivalued attribute. Only changed values get
+        # deleted and added, unless replacing all values is cheaper. Order of
+        # values is not significant in LDAP.
+        old_values = isinstance(old, list) and old or [old]
+        new_values = isinstance(new, list) and new or [new]
+        old_set = set(old_values)
+        new_set = set(new_values)
+        deleted = [val for val in old_values if val not in new_set]
+        added = [val for val in new_values if val not in old_set]
+        if not deleted and not added:
+            return []
+        if not self.attrs.is_binary(key):
+            new, deleted, added = encode(new), encode(deleted), encode(added)
+        if not new_values or len(deleted) + len(added) >= len(new_values):
+            return [(MOD_REPLACE, encode(key), new)]
+        modlist = list()
+        if deleted:
+            modlist.append((MOD_DELETE, encode(key), deleted))
+        if added:
+            modlist.append((MOD_ADD, encode(key), added))
+        return modlist
 
     @default
     def _ldap_delete(self):
@@ -666,3 +1195,184 @@ class LDAPNode(object):
         'removed': LDAPNodeRemovedEvent,
         'detached': LDAPNodeDetachedEvent,
     }
+
+
+@implementer(ILDAPReadOnly)
+class LDAPReadOnly(Behavior):
+    """Prevent modification of LDAP nodes.
+    """
+
+    @plumb
+    def __setitem__(_next, self, key, val):
+        raise RuntimeError(u"Read only node. Cannot add '%s'." % (key,))
+
+    @plumb
+    def __delitem__(_next, self, key):
+        raise RuntimeError(u"Read only node. Cannot delete '%s'." % (key,))
+
+
+class _LDAPReadOnlyNodeAttributesSlots(object):
+    __slots__ = ('__name__', '__parent__', '_storage')
+
+
+@plumbing(
+    Nodify,
+    OdictStorage)
+class LDAPReadOnlyNodeAttributes(_LDAPReadOnlyNodeAttributesSlots):
+    """Attributes for LDAPReadOnlyNode.
+
+    Modifications are not tracked, thus no snapshot of persisted values is
+    kept.
+    """
+    __slots__ = ()
+    changed = False
+
+    def __init__(self, name=None, parent=None):
+        self.__name__ = name
+        self.__parent__ = parent
+        self.load()
+
+    def load(self):
+        ldap_node = self.parent
+        if not ldap_node.name or not ldap_node.ldap_session:
+            return
+        storage = self.storage
+        storage.clear()
+        # attributes already fetched while iterating parent
+        attrs = ldap_node._prefetched_attrs
+        if attrs is not None:
+            ldap_node._prefetched_attrs = None
+        else:
+            entry = ldap_node.ldap_session.search(
+                scope=BASE,
+                baseDN=ldap_node.DN.encode('utf-8'),
+                force_reload=ldap_node._reload,
+                attrlist=['*'],
+            )
+            if len(entry) != 1:
+                raise RuntimeError(                        # pragma NO COVERAGE
+                    u"Fatal. Expected entry does not "     # pragma NO COVERAGE
+                    u"exist or more than one entry found"  # pragma NO COVERAGE
+                )                                          # pragma NO COVERAGE
+            attrs = entry[0][1]
+        for key, item in attrs.items():
+            if not self.is_binary(key):
+                item = decode(item)
+            if len(item) == 1 and not self.is_multivalued(key):
+                item = item[0]
+            storage[decode(key)] = item
+
+    def __setitem__(self, key, val):
+        raise RuntimeError(u"Read only attributes. Cannot set '%s'." % (key,))
+
+    def __delitem__(self, key):
+        raise RuntimeError(
+            u"Read only attributes. Cannot delete '%s'." % (key,))
+
+    def is_binary(self, name):
+        return name in self.parent.root._binary_attributes
+
+    def is_multivalued(self, name):
+        return name in self.parent.root._multivalued_attributes
+
+    def __repr__(self):
+        name = unicode(self.parent.name).encode('ascii', 'replace')
+        return "<%s object '%s' at %s>" % (self.__class__.__name__,
+                                           name,
+                                           hex(id(self))[:-1])
+
+
+class _LDAPReadOnlyNodeSlots(object):
+    __slots__ = (
+        '__name__',
+        '__parent__',
+        '_nodespaces',
+        '_storage',
+        '_dn',
+        '_ldap_session',
+        '_ldap_schema_info',
+        '_reload',
+        '_prefetched_attrs',
+        '_known',
+        '_children_loaded',
+    )
+
+
+@plumbing(
+    Nodespaces,
+    Attributes,
+    Nodify,
+    LDAPStorage,
+    LDAPReadOnly)
+class LDAPReadOnlyNode(_LDAPReadOnlyNodeSlots):
+    """Lightweight LDAP node for reading big amounts of entries.
+
+    Instance attributes are stored in slots. Search and iteration related
+    settings are class attributes, change them on a subclass. Children are
+    read only nodes as well. Nodes and attributes cannot be modified, no
+    lifecycle events are triggered.
+
+    Use it as ``child_factory`` of an ``LDAPNode`` containing many entries.
+    """
+    __slots__ = ()
+    attributes_factory = LDAPReadOnlyNodeAttributes
+    # read only nodes never get changed
+    _changed = False
+    _action = None
+    _added_children = frozenset()
+    _modified_children = frozenset()
+    _deleted_children = frozenset()
+    # search and iteration related defaults
+    search_scope = ONELEVEL
+    search_filter = None
+    search_criteria = None
+    search_relation = None
+    child_defaults = None
+    prefetch = False
+
+    def __init__(self, name=None, props=None):
+        """Read only LDAP Node expects ``name`` and ``props`` arguments for
+        the root node or nothing for children.
+        """
+        if (name and not props) or (props and not name):
+            raise ValueError(u"Wrong initialization.")
+        if name and not isinstance(name, unicode):
+            name = name.decode(CHARACTER_ENCODING)
+        self.__name__ = name
+        self.__parent__ = None
+        self._nodespaces = None
+        self._dn = None
+        self._ldap_session = None
+        self._ldap_schema_info = None
+        self._reload = False
+        self._prefetched_attrs = None
+        self._known = None
+        self._children_loaded = False
+        if props:
+            # only at root node
+            self._ldap_session = LDAPSession(props)
+            self._ldap_session.baseDN = self.DN
+            self._ldap_schema_info = LDAPSchemaInfo(props)
+
+    @property
+    def child_factory(self):
+        return self.__class__
+
+    @property
+    def _known_children(self):
+        # created on first access, most read only nodes are leafs
+        if self._known is None:
+            self._known = dict()
+        return self._known
+
+    @property
+    def _multivalued_attributes(self):
+        return self.ldap_session._props.multivalued_attributes
+
+    @property
+    def _binary_attributes(self):
+        return self.ldap_session._props.binary_attributes
+
+    @property
+    def _page_size(self):
+        return self.ldap_session._props.page_size
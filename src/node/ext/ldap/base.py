@@ -1,18 +1,33 @@
 # -*- coding: utf-8 -*-
 from bda.cache import ICacheManager
 from bda.cache.interfaces import INullCacheProvider
+from contextlib import contextmanager
+from node.ext.ldap.cache import CacheEntry
+from node.ext.ldap.cache import cache_index_for
+from node.ext.ldap.cache import compact_result
+from node.ext.ldap.cache import expand_result
+from node.ext.ldap.cache import hash_key
 from node.ext.ldap.cache import nullcacheProviderFactory
+from node.ext.ldap.cache import single_flight
 from node.ext.ldap.interfaces import ICacheProviderFactory
+from node.ext.ldap.interfaces import IHashableKeyCacheProvider
+from node.ext.ldap.pool import LDAPConnectionPool
 from node.ext.ldap.properties import LDAPProps
 from zope.component import queryUtility
 
+import binascii
 import hashlib
 import ldap
 import logging
+import os
+import time
 
 
 logger = logging.getLogger('node.ext.ldap')
 
+# length of the token prefixed to paging cookies of pooled searches
+PAGING_TOKEN_LENGTH = 16
+
 
 def testLDAPConnectivity(server=None, port=None, props=None):
     """Function to test the availability of the LDAP Server.
@@ -77,29 +92,96 @@ class LDAPConnector(object):
         self._bindPW = props.password
         self._cache = props.cache
         self._cachetimeout = props.timeout
+        self._cache_stale_timeout = getattr(props, 'cache_stale_timeout', 0)
+        self._cache_compact = getattr(props, 'cache_compact', False)
+        self._cache_compress_threshold = getattr(
+            props, 'cache_compress_threshold', 4096)
         self._start_tls = props.start_tls
         self._ignore_cert = props.ignore_cert
         self._tls_cacert_file = props.tls_cacertfile
-
-    def bind(self):
-        """Bind to Server and return the Connection Object.
+        # props implementations may not know about pooling yet
+        self._pool_min_size = getattr(props, 'pool_min_size', 0)
+        self._pool_max_size = getattr(props, 'pool_max_size', 0)
+        self._pool_idle_timeout = getattr(props, 'pool_idle_timeout', 300.0)
+        self._pool_check_interval = getattr(props, 'pool_check_interval', 30.0)
+        self._pool_checkout_timeout = getattr(
+            props, 'pool_checkout_timeout', 30.0)
+        self._pool_reserve_timeout = getattr(
+            props, 'pool_reserve_timeout', 60.0)
+        self._auth_pool_size = getattr(props, 'auth_pool_size', 0)
+
+    def connect(self, bind=True, ldapobject_class=None):
+        """Create and return a new Connection Object.
+
+        In contrast to ``bind``, the connection is not remembered on the
+        connector.
+
+        bind
+            Flag whether to bind the connection with the configured
+            credentials.
+
+        ldapobject_class
+            Class of the connection object. Gets called with the LDAP URI.
+            Defaults to the class used by ``ldap.initialize``.
         """
         if self._ignore_cert:
             ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER)
         elif self._tls_cacert_file:
             ldap.set_option(ldap.OPT_X_TLS_CACERTFILE, self._tls_cacert_file)
-        self._con = ldap.initialize(self._uri)
+        if ldapobject_class is None:
+            con = ldap.initialize(self._uri)
+        else:
+            con = ldapobject_class(self._uri)
         # Turning referrals off since they cause problems with MS Active Directory
         # More info: https://www.python-ldap.org/faq.html#usage
-        self._con.set_option(ldap.OPT_REFERRALS,0)
-        self._con.protocol_version = self.protocol
+        con.set_option(ldap.OPT_REFERRALS,0)
+        con.protocol_version = self.protocol
         if self._start_tls:
             # ignore in tests for now. nevertheless provide a test environment
             # for TLS and SSL later
-            self._con.start_tls_s()                        # pragma NO COVERAGE
-        self._con.simple_bind_s(self._bindDN, self._bindPW)
+            con.start_tls_s()                              # pragma NO COVERAGE
+        if bind:
+            con.simple_bind_s(self._bindDN, self._bindPW)
+        return con
+
+    def bind(self):
+        """Bind to Server and return the Connection Object.
+        """
+        self._con = self.connect()
         return self._con
 
+    def pool(self):
+        """Create and return a ``LDAPConnectionPool`` if pooling is enabled
+        by ``pool_max_size``, otherwise None.
+        """
+        if not self._pool_max_size:
+            return None
+        return LDAPConnectionPool(
+            self.connect,
+            min_size=self._pool_min_size,
+            max_size=self._pool_max_size,
+            idle_timeout=self._pool_idle_timeout,
+            check_interval=self._pool_check_interval,
+            checkout_timeout=self._pool_checkout_timeout,
+            reserve_timeout=self._pool_reserve_timeout,
+        )
+
+    def auth_pool(self):
+        """Create and return a ``LDAPConnectionPool`` of unbound connections
+        used for credential checks if enabled by ``auth_pool_size``, otherwise
+        None.
+        """
+        if not self._auth_pool_size:
+            return None
+        return LDAPConnectionPool(
+            lambda: self.connect(bind=False),
+            max_size=self._auth_pool_size,
+            idle_timeout=self._pool_idle_timeout,
+            check_interval=self._pool_check_interval,
+            checkout_timeout=self._pool_checkout_timeout,
+            reserve_timeout=self._pool_reserve_timeout,
+        )
+
     def unbind(self):
         """Unbind from Server.
         """
@@ -123,14 +205,27 @@ class LDAPCommunicator(object):
         self.baseDN = ''
         self._connector = connector
         self._con = None
+        self._pool = None
         self._cache = None
+        self._cache_index = None
+        self._cache_hashable_keys = False
         if connector._cache:
             cachefactory = queryUtility(ICacheProviderFactory)
             if cachefactory is None:
                 cachefactory = nullcacheProviderFactory
             cacheprovider = cachefactory()
             self._cache = ICacheManager(cacheprovider)
-            self._cache.setTimeout(connector._cachetimeout)
+            timeout = connector._cachetimeout
+            if timeout and connector._cache_stale_timeout:
+                # keep entries for serving them stale
+                timeout += connector._cache_stale_timeout
+            self._cache.setTimeout(timeout)
+            if not INullCacheProvider.providedBy(cacheprovider):
+                # track cached searches for invalidation on write
+                self._cache_index = cache_index_for(cachefactory)
+            # use tuple keys if cache provider supports them
+            self._cache_hashable_keys = \
+                IHashableKeyCacheProvider.providedBy(cacheprovider)
             if not INullCacheProvider.providedBy(self._cache):
                 logger.debug(
                     u"LDAP Caching activated for instance '{0:s}'. "
@@ -146,17 +241,45 @@ class LDAPCommunicator(object):
                     )
                 )
 
+    @property
+    def bound(self):
+        """Flag whether communicator is bound to LDAP Server.
+        """
+        return self._con is not None or self._pool is not None
+
     def bind(self):
         """Bind to LDAP Server.
+
+        If connection pooling is enabled, the pool gets created and one
+        connection is opened in order to detect connectivity problems early.
         """
-        self._con = self._connector.bind()
+        pool = self._connector.pool()
+        if pool is None:
+            self._con = self._connector.bind()
+            return
+        pool.checkin(pool.checkout())
+        self._pool = pool
 
     def unbind(self):
         """Unbind from LDAP Server.
         """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+            return
         self._connector.unbind()
         self._con = None
 
+    @contextmanager
+    def _connection(self):
+        # yield connection to use for a single LDAP operation. If pooling is
+        # enabled, the connection is borrowed from the pool
+        if self._pool is None:
+            yield self._con
+        else:
+            with self._pool.connection() as con:
+                yield con
+
     def search(self, queryFilter, scope, baseDN=None,
                force_reload=False, attrlist=None, attrsonly=0,
                page_size=None, cookie=None):
@@ -192,11 +315,32 @@ class LDAPCommunicator(object):
             if not baseDN:
                 raise ValueError(u"baseDN unset.")
 
+        # normalize attrlist before it is used for the cache key, thus
+        # searches of search_many share cache entries
+        if type(attrlist) in (list, tuple):
+            attrlist = [str(_) for _ in attrlist]
+
+        # paged results cookies are bound to the connection they were issued
+        # on. If pooling, the connection gets reserved for the next page. The
+        # cookie returned by the server is prefixed with a token unique to
+        # the paged search, since server cookies of different searches may
+        # be equal.
+        token = None
+        server_cookie = cookie
         if page_size:
             if cookie is None:
-                cookie = ''
+                cookie = server_cookie = ''
+            if self._pool is not None:
+                if cookie:
+                    if len(cookie) <= PAGING_TOKEN_LENGTH:
+                        raise ValueError(u"Invalid paging cookie.")
+                    token = cookie[:PAGING_TOKEN_LENGTH]
+                    server_cookie = cookie[PAGING_TOKEN_LENGTH:]
+                else:
+                    token = binascii.hexlify(
+                        os.urandom(PAGING_TOKEN_LENGTH // 2))
             pagedresults = ldap.controls.libldap.SimplePagedResultsControl(
-                criticality=True, size=page_size, cookie=cookie)
+                criticality=True, size=page_size, cookie=server_cookie)
             serverctrls = [pagedresults]
         else:
             if cookie:
@@ -207,46 +351,289 @@ class LDAPCommunicator(object):
                     attrlist, attrsonly, serverctrls):
             # we have to do async search to also retrieve server controls
             # in case we do pagination of results
-            if type(attrlist) in (list, tuple):
-                attrlist = [str(_) for _ in attrlist]
-
-            msgid = self._con.search_ext(
-                baseDN,
-                scope,
-                queryFilter,
-                attrlist,
-                attrsonly,
-                serverctrls=serverctrls
-            )
-            rtype, results, rmsgid, rctrls = self._con.result3(msgid)
+            pool = self._pool
+            if pool is None:
+                con = self._con
+            else:
+                con = pool.checkout(key=cookie or None)
+            next_cookie = None
+            try:
+                msgid = con.search_ext(
+                    baseDN,
+                    scope,
+                    queryFilter,
+                    attrlist,
+                    attrsonly,
+                    serverctrls=serverctrls
+                )
+                rtype, results, rmsgid, rctrls = con.result3(msgid)
+            except (ldap.SERVER_DOWN, ldap.CONNECT_ERROR):
+                if pool is not None:
+                    pool.discard(con)
+                raise
+            except Exception:
+                if pool is not None:
+                    pool.checkin(con)
+                raise
             ctype = ldap.controls.libldap.SimplePagedResultsControl.controlType
             pctrls = [c for c in rctrls if c.controlType == ctype]
             if pctrls:
-                return results, pctrls[0].cookie
+                next_cookie = pctrls[0].cookie
+                if next_cookie and token is not None:
+                    next_cookie = token + next_cookie
+            if pool is not None:
+                pool.checkin(con, key=next_cookie or None)
+            if pctrls:
+                return results, next_cookie
             else:
                 return results
 
         args = [baseDN, scope, queryFilter, attrlist, attrsonly, serverctrls]
         if self._cache:
-            key_items = [
-                self._connector._bindDN,
+            key = self._cache_key(baseDN, scope, queryFilter, attrlist,
+                                  attrsonly, page_size, cookie)
+            return self._cached(key, _search, args, force_reload)
+        return _search(*args)
+
+    def search_many(self, queries, force_reload=False):
+        """Perform several searches at once.
+
+        All search requests are sent to the server before any result is
+        awaited, thus the network round trip is paid roughly once for all
+        searches.
+
+        queries
+            List of dicts containing search arguments. Supported keys are
+            ``queryFilter``, ``scope``, ``baseDN``, ``attrlist`` and
+            ``attrsonly``, with the same meaning and defaults as in
+            ``search``. ``scope`` defaults to ``BASE``.
+
+        force_reload
+            Force reload of results if cache enabled.
+
+        Return list of results in order of given queries. If a search failed,
+        the corresponding list item is the ``ldap.LDAPError`` instance raised
+        by the server.
+        """
+        results = [None] * len(queries)
+        requests = list()
+        for index, query in enumerate(queries):
+            baseDN = query.get('baseDN')
+            if baseDN is None:
+                baseDN = self.baseDN
+                if not baseDN:
+                    raise ValueError(u"baseDN unset.")
+            attrlist = query.get('attrlist')
+            if type(attrlist) in (list, tuple):
+                attrlist = [str(_) for _ in attrlist]
+            args = (
                 baseDN,
-                sorted(attrlist or []),
-                attrsonly,
-                queryFilter,
-                scope,
-                page_size,
-                cookie
-            ]
-            key = '-'.join([str(_) for _ in key_items])
-            key = md5digest(key)
-            return self._cache.getData(
-                _search,
-                key,
-                force_reload,
-                args
+                query.get('scope', ldap.SCOPE_BASE),
+                query.get('queryFilter', '(objectClass=*)'),
+                attrlist,
+                query.get('attrsonly', 0),
             )
-        return _search(*args)
+            key = None
+            if self._cache:
+                key = self._cache_key(*args)
+                cached, stale = self._cache_get(key, force_reload)
+                if cached is not None and not stale:
+                    results[index] = cached
+                    continue
+            requests.append((index, key, args))
+        if not requests:
+            return results
+        generation = self._cache_generation()
+        with self._connection() as con:
+            msgids = list()
+            for index, key, args in requests:
+                try:
+                    msgids.append(con.search_ext(*args))
+                except (ldap.SERVER_DOWN, ldap.CONNECT_ERROR):
+                    raise
+                except ldap.LDAPError, error:
+                    # e.g. invalid filter, detected before sending
+                    msgids.append(None)
+                    results[index] = error
+            for (index, key, args), msgid in zip(requests, msgids):
+                if msgid is None:
+                    continue
+                try:
+                    rtype, res, rmsgid, rctrls = con.result3(msgid)
+                except (ldap.SERVER_DOWN, ldap.CONNECT_ERROR):
+                    raise
+                except ldap.LDAPError, error:
+                    results[index] = error
+                    continue
+                results[index] = res
+                if key is not None:
+                    self._cache_set(key, res, args[0], args[1], generation)
+        return results
+
+    def _cached(self, key, func, args, force_reload=False):
+        # return cached result or call func and cache its result. Concurrent
+        # calls for the same key are coalesced. Stale results are returned
+        # while getting refreshed in the background. The background refresh
+        # needs a connection of its own, thus stale results are refreshed
+        # immediately if pooling is disabled.
+        res, stale = self._cache_get(key, force_reload)
+        if res is not None:
+            if not stale:
+                return res
+            if self._pool is not None:
+                single_flight.start(key, self._cache_load, [key, func, args])
+                return res
+        return single_flight.do(key, self._cache_load, [key, func, args])
+
+    def _cache_load(self, key, func, args):
+        generation = self._cache_generation()
+        res = func(*args)
+        self._cache_set(key, res, args[0], args[1], generation)
+        return res
+
+    def _cache_get(self, key, force_reload=False):
+        # return cached result and flag whether it is stale
+        res = self._cache.get(key, force_reload)
+        stale = False
+        if isinstance(res, CacheEntry):
+            res, stale = res.value, res.stale
+        if isinstance(res, str):
+            res = expand_result(res)
+        return res, stale
+
+    def _cache_set(self, key, res, baseDN, scope, generation=None):
+        # store result and remember it for invalidation on write. Result gets
+        # dropped again if a write operation happened since generation.
+        if self._connector._cache_compact:
+            res = compact_result(
+                res, self._connector._cache_compress_threshold)
+        timeout = self._connector._cachetimeout
+        if timeout and self._connector._cache_stale_timeout:
+            res = CacheEntry(res, time.time() + timeout)
+            timeout += self._connector._cache_stale_timeout
+        self._cache.set(key, res)
+        if self._cache_index is None:
+            return
+        evicted = self._cache_index.register(
+            baseDN, scope, key, timeout, generation)
+        for evicted_key in evicted:
+            del self._cache[evicted_key]
+
+    def _cache_generation(self):
+        # generation of cache index before performing a search
+        if self._cache_index is None:
+            return None
+        return self._cache_index.generation()
+
+    def _cache_invalidate(self, dn):
+        # evict cached searches possibly affected by write operation on DN
+        if self._cache_index is None:
+            return
+        for key in self._cache_index.affected(dn):
+            del self._cache[key]
+
+    def _cache_key(self, baseDN, scope, queryFilter, attrlist, attrsonly,
+                   page_size=None, cookie=None):
+        # create cache key for search. Tuple keys are used as is by cache
+        # providers accepting hashable keys, otherwise they get hashed.
+        key = (
+            self._connector._bindDN,
+            baseDN,
+            attrlist and tuple(sorted(attrlist)) or None,
+            attrsonly,
+            str(queryFilter),
+            scope,
+            page_size,
+            cookie
+        )
+        if self._cache_hashable_keys:
+            return key
+        return hash_key(key)
+
+    def search_iter(self, queryFilter, scope, baseDN=None, attrlist=None,
+                    attrsonly=0, page_size=None):
+        """Search the directory and yield result entries as they arrive.
+
+        In contrast to ``search``, the result is never materialized as a
+        whole, thus results are not cached.
+
+        queryFilter
+            LDAP query filter
+
+        scope
+            LDAP search scope
+
+        baseDN
+            Search base. Defaults to ``self.baseDN``
+
+        attrlist
+            LDAP attrlist to query.
+
+        attrsonly
+            Flag whether to return only attribute names, without corresponding
+            values.
+
+        page_size
+            If given, results are requested in pages of this size one after
+            another.
+        """
+        if baseDN is None:
+            baseDN = self.baseDN
+            if not baseDN:
+                raise ValueError(u"baseDN unset.")
+        if type(attrlist) in (list, tuple):
+            attrlist = [str(_) for _ in attrlist]
+        pool = self._pool
+        if pool is None:
+            con = self._con
+        else:
+            con = pool.checkout()
+        ctype = ldap.controls.libldap.SimplePagedResultsControl.controlType
+        msgid = None
+        broken = False
+        try:
+            cookie = ''
+            while True:
+                serverctrls = []
+                if page_size:
+                    serverctrls.append(
+                        ldap.controls.libldap.SimplePagedResultsControl(
+                            criticality=True, size=page_size, cookie=cookie))
+                msgid = con.search_ext(
+                    baseDN,
+                    scope,
+                    queryFilter,
+                    attrlist,
+                    attrsonly,
+                    serverctrls=serverctrls
+                )
+                while True:
+                    # fetch one message at a time
+                    rtype, results, rmsgid, rctrls = con.result3(msgid, all=0)
+                    if rtype == ldap.RES_SEARCH_RESULT:
+                        break
+                    for entry in results:
+                        yield entry
+                msgid = None
+                pctrls = [c for c in rctrls if c.controlType == ctype]
+                cookie = pctrls and pctrls[0].cookie or ''
+                if not cookie:
+                    break
+        except (ldap.SERVER_DOWN, ldap.CONNECT_ERROR):
+            broken = True
+            raise
+        finally:
+            if msgid is not None and not broken:
+                # generator has been closed before search was done
+                try:
+                    con.abandon(msgid)
+                except ldap.LDAPError:                     # pragma NO COVERAGE
+                    pass                                   # pragma NO COVERAGE
+            if pool is not None:
+                if broken:
+                    pool.discard(con)
+                else:
+                    pool.checkin(con)
 
     def add(self, dn, data):
         """Insert an entry into directory.
@@ -258,7 +645,9 @@ class LDAPCommunicator(object):
             dict containing key/value pairs of entry attributes
         """
         attributes = [(k, v) for k, v in data.items()]
-        self._con.add_s(dn, attributes)
+        with self._connection() as con:
+            con.add_s(dn, attributes)
+        self._cache_invalidate(dn)
 
     def modify(self, dn, modlist):
         """Modify an existing entry in the directory.
@@ -269,17 +658,77 @@ class LDAPCommunicator(object):
         gives the name of the field to modify, and the third gives the new
         value for the field (for MOD_ADD and MOD_REPLACE).
         """
-        self._con.modify_s(dn, modlist)
+        with self._connection() as con:
+            con.modify_s(dn, modlist)
+        self._cache_invalidate(dn)
 
     def delete(self, deleteDN):
         """Delete an entry from the directory.
 
         Take the DN to delete from the directory as argument.
         """
-        self._con.delete_s(deleteDN)
+        with self._connection() as con:
+            con.delete_s(deleteDN)
+        self._cache_invalidate(deleteDN)
 
     def passwd(self, userdn, oldpw, newpw):
-        self._con.passwd_s(userdn, oldpw, newpw)
+        with self._connection() as con:
+            con.passwd_s(userdn, oldpw, newpw)
+        self._cache_invalidate(userdn)
+
+    def write_many(self, operations):
+        """Perform several write operations at once.
+
+        All requests are sent to the server before any result is awaited.
+        The server may process the operations in any order, thus operations
+        must not depend on each other.
+
+        operations
+            List of ``(action, dn, data)`` tuples. ``action`` is one of
+            ``'add'``, ``'modify'`` or ``'delete'``. ``data`` is the entry
+            dict for ``'add'``, the modification list for ``'modify'`` and
+            ignored for ``'delete'``.
+
+        Return list of errors in order of given operations. The list item is
+        ``None`` if the operation succeeded, otherwise the ``ldap.LDAPError``
+        instance raised by the server.
+        """
+        for action, dn, data in operations:
+            if action not in ['add', 'modify', 'delete']:
+                raise ValueError(u"Unknown operation '%s'." % (action,))
+        errors = [None] * len(operations)
+        if not operations:
+            return errors
+        with self._connection() as con:
+            msgids = list()
+            for index, (action, dn, data) in enumerate(operations):
+                try:
+                    if action == 'add':
+                        attributes = [(k, v) for k, v in data.items()]
+                        msgid = con.add_ext(dn, attributes)
+                    elif action == 'modify':
+                        msgid = con.modify_ext(dn, data)
+                    else:
+                        msgid = con.delete_ext(dn)
+                except (ldap.SERVER_DOWN, ldap.CONNECT_ERROR):
+                    raise
+                except ldap.LDAPError, error:
+                    msgid = None
+                    errors[index] = error
+                msgids.append(msgid)
+            for index, msgid in enumerate(msgids):
+                if msgid is None:
+                    continue
+                try:
+                    con.result3(msgid)
+                except (ldap.SERVER_DOWN, ldap.CONNECT_ERROR):
+                    raise
+                except ldap.LDAPError, error:
+                    errors[index] = error
+        for (action, dn, data), error in zip(operations, errors):
+            if error is None:
+                self._cache_invalidate(dn)
+        return errors
 
 
 def main():
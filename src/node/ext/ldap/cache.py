@@ -1,8 +1,30 @@
 # -*- coding: utf-8 -*-
+from bda.cache import ICacheManager
 from bda.cache import Memcached
 from bda.cache import NullCache
+from collections import OrderedDict
+from collections import deque
 from node.ext.ldap.interfaces import ICacheProviderFactory
+from node.ext.ldap.interfaces import ILRUCacheProvider
+from node.ext.ldap.interfaces import ITwoTierCacheProvider
+from node.ext.ldap.scope import BASE
+from node.ext.ldap.scope import ONELEVEL
+from zope.component import adapter
+from zope.component import provideAdapter
 from zope.interface import implementer
+import copy
+import hashlib
+import ldap
+import logging
+import marshal
+import sys
+import threading
+import time
+import weakref
+import zlib
+
+
+logger = logging.getLogger('node.ext.ldap')
 
 
 def nullcacheProviderFactory():
@@ -23,3 +45,646 @@ class MemcachedProviderFactory(object):
 
     def __call__(self):
         return Memcached(self.servers)
+
+
+def hash_key(key):
+    """Return string representation of cache key, for cache providers
+    requiring string keys.
+    """
+    return hashlib.md5(repr(key)).hexdigest()
+
+
+def estimate_size(value):
+    """Estimate memory consumption of a search result in bytes.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, val in value.iteritems():
+            size += estimate_size(key) + estimate_size(val)
+    elif isinstance(value, (list, tuple)):
+        for val in value:
+            size += estimate_size(val)
+    return size
+
+
+def compact_result(res, compress_threshold=0):
+    """Encode search result as compact string.
+
+    Attribute names and DN suffixes get stored only once. The encoded result
+    gets zlib compressed if bigger than ``compress_threshold`` bytes.
+
+    res
+        Result as returned by ``LDAPCommunicator.search``, either a list of
+        entries or a tuple containing list of entries and paging cookie.
+    """
+    paged = isinstance(res, tuple)
+    cookie = None
+    if paged:
+        res, cookie = res
+    names = dict()
+    suffixes = dict()
+    entries = list()
+    for dn, attrs in res:
+        if dn is None or not isinstance(attrs, dict):
+            # e.g. search references, kept as is
+            entries.append((dn, -1, None, attrs))
+            continue
+        rdn, sep, suffix = dn.partition(',')
+        if sep:
+            suffix_index = suffixes.setdefault(suffix, len(suffixes))
+        else:
+            # DN without suffix
+            suffix_index = -2
+        name_indices = list()
+        values = list()
+        for name, value in attrs.iteritems():
+            name_indices.append(names.setdefault(name, len(names)))
+            values.append(value)
+        entries.append((rdn, suffix_index, name_indices, values))
+    names = [name for name, _ in sorted(names.items(), key=lambda x: x[1])]
+    suffixes = [
+        suffix for suffix, _ in sorted(suffixes.items(), key=lambda x: x[1])
+    ]
+    data = marshal.dumps((names, suffixes, entries, paged, cookie))
+    if compress_threshold and len(data) > compress_threshold:
+        return 'z' + zlib.compress(data)
+    return 'm' + data
+
+
+def expand_result(data):
+    """Decode search result encoded by ``compact_result``.
+    """
+    data = data[0] == 'z' and zlib.decompress(data[1:]) or data[1:]
+    names, suffixes, entries, paged, cookie = marshal.loads(data)
+    names = [intern(name) for name in names]
+    res = list()
+    for rdn, suffix_index, name_indices, values in entries:
+        if suffix_index == -1:
+            res.append((rdn, values))
+            continue
+        dn = suffix_index == -2 and rdn or rdn + ',' + suffixes[suffix_index]
+        attrs = dict()
+        for name_index, value in zip(name_indices, values):
+            attrs[names[name_index]] = value
+        res.append((dn, attrs))
+    if paged:
+        return res, cookie
+    return res
+
+
+@implementer(ILRUCacheProvider)
+class LRUCache(object):
+    """Thread safe in-process cache.
+
+    Least recently used entries get evicted if either ``max_entries`` or
+    ``max_bytes`` is exceeded.
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=32 * 1024 * 1024,
+                 timeout=0):
+        """
+        max_entries
+            Maximum number of cached entries.
+
+        max_bytes
+            Maximum estimated size of all cached entries in bytes. 0 means
+            no limit.
+
+        timeout
+            Default lifetime of entries in seconds. 0 means forever.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # key -> (value, expires, size). Most recently used at the end.
+        self._data = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+
+    def size(self):
+        return self._size
+
+    def keys(self):
+        with self._lock:
+            return self._data.keys()
+
+    def values(self):
+        with self._lock:
+            return [entry[0] for entry in self._data.values()]
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires, size = entry
+            if expires and expires <= time.time():
+                self._size -= size
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data[key] = entry
+            self.hits += 1
+            return value
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def set(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        expires = timeout and time.time() + timeout or 0
+        size = estimate_size(value)
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self._size -= entry[2]
+            if self.max_bytes and size > self.max_bytes:
+                # too big for this cache at all
+                return
+            self._data[key] = (value, expires, size)
+            self._size += size
+            while len(self._data) > self.max_entries \
+                    or (self.max_bytes and self._size > self.max_bytes):
+                entry = self._data.popitem(last=False)[1]
+                self._size -= entry[2]
+                self.evictions += 1
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self._size -= entry[2]
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'entries': len(self._data),
+            'bytes': self._size,
+        }
+
+
+@implementer(ICacheManager)
+@adapter(ILRUCacheProvider)
+class LRUCacheManager(object):
+    """Cache manager for ``LRUCache``.
+
+    The timeout is kept on the manager and applied per entry, thus
+    communicators with different timeouts can share one cache.
+    """
+
+    def __init__(self, context):
+        self.cache = context
+        self.timeout = None
+
+    def setTimeout(self, timeout):
+        self.timeout = timeout
+
+    def getData(self, func, key, force_reload=False, args=[], kwargs={}):
+        ret = self.get(key, force_reload)
+        if ret is None:
+            ret = func(*args, **kwargs)
+            self.set(key, ret)
+        return ret
+
+    def get(self, key, force_reload=False):
+        if force_reload:
+            del self.cache[key]
+            return None
+        return self.cache.get(key)
+
+    def set(self, key, item):
+        self.cache.set(key, item, timeout=self.timeout)
+
+    def rem(self, key):
+        del self.cache[key]
+
+    def __delitem__(self, key):
+        del self.cache[key]
+
+
+provideAdapter(LRUCacheManager)
+
+
+@implementer(ICacheProviderFactory)
+class LRUCacheProviderFactory(object):
+    """In-process LRU cache provider factory.
+
+    All communicators share one cache instance.
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=32 * 1024 * 1024):
+        self.cache = LRUCache(max_entries=max_entries, max_bytes=max_bytes)
+
+    def __call__(self):
+        return self.cache
+
+
+@implementer(ITwoTierCacheProvider)
+class TwoTierCache(object):
+    """Cache consulting an in-process cache before a remote cache.
+
+    Entries found in the remote cache are stored in the local cache. The
+    lifetime of local entries is limited by ``local_timeout``, thus changes
+    made by other processes show up after ``local_timeout`` seconds at the
+    latest.
+
+    Keys other than strings are hashed for the remote cache.
+    """
+
+    def __init__(self, local, remote, local_timeout=60):
+        """
+        local
+            ``LRUCache`` instance.
+
+        remote
+            Remote cache provider, e.g. ``bda.cache.Memcached`` instance.
+
+        local_timeout
+            Maximum lifetime of entries in the local cache in seconds.
+        """
+        self.local = local
+        self.remote = remote
+        self.local_timeout = local_timeout
+
+    def reset(self):
+        self.local.reset()
+        self.remote.reset()
+
+    def size(self):
+        # size of local cache. Remote cache size is too expensive to compute
+        return self.local.size()
+
+    def keys(self):
+        return self.local.keys()
+
+    def values(self):
+        return self.local.values()
+
+    def get(self, key, default=None):
+        value = self.local.get(key)
+        if value is not None:
+            return value
+        value = self.remote.get(self._remote_key(key))
+        if value is None:
+            return default
+        self.local.set(key, value, timeout=self.local_timeout)
+        return value
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def set(self, key, value, timeout=None):
+        local_timeout = self.local_timeout
+        if timeout and (not local_timeout or timeout < local_timeout):
+            local_timeout = timeout
+        self.local.set(key, value, timeout=local_timeout)
+        self.remote[self._remote_key(key)] = value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        del self.local[key]
+        del self.remote[self._remote_key(key)]
+
+    def _remote_key(self, key):
+        if isinstance(key, str):
+            return key
+        return hash_key(key)
+
+
+@implementer(ICacheManager)
+@adapter(ITwoTierCacheProvider)
+class TwoTierCacheManager(LRUCacheManager):
+    """Cache manager for ``TwoTierCache``.
+    """
+
+    def setTimeout(self, timeout):
+        self.timeout = timeout
+        self.cache.remote.timeout = timeout
+
+
+provideAdapter(TwoTierCacheManager)
+
+
+@implementer(ICacheProviderFactory)
+class TwoTierCacheProviderFactory(object):
+    """Two tier cache provider factory.
+
+    All communicators share one local cache. The remote cache provider is
+    created by ``remote_factory``, which defaults to
+    ``MemcachedProviderFactory``.
+    """
+
+    def __init__(self, remote_factory=None, max_entries=1000,
+                 max_bytes=32 * 1024 * 1024, local_timeout=60):
+        if remote_factory is None:
+            remote_factory = MemcachedProviderFactory()
+        self.remote_factory = remote_factory
+        self.local = LRUCache(max_entries=max_entries, max_bytes=max_bytes)
+        self.local_timeout = local_timeout
+
+    def __call__(self):
+        return TwoTierCache(
+            self.local,
+            self.remote_factory(),
+            local_timeout=self.local_timeout
+        )
+
+
+def _explode_dn(dn):
+    # normalized RDN's of DN
+    try:
+        return [rdn.lower() for rdn in ldap.dn.explode_dn(dn)]
+    except ldap.LDAPError:
+        return [rdn.strip().lower() for rdn in dn.split(',') if rdn.strip()]
+
+
+class LDAPCacheIndex(object):
+    """Index of cached search results by base DN and scope.
+
+    Used to evict cached results which may be affected by a write operation
+    on a DN. Indirect changes made by the server, e.g. by the ``memberOf``
+    overlay, are not covered.
+
+    Each write operation increases the generation of the index. Results of
+    searches started before a write operation possibly affecting them are
+    refused on ``register``, thus a write during an in flight search never
+    leaves a stale unindexed cache entry.
+    """
+
+    def __init__(self, max_entries=10000, prune_interval=60.0,
+                 max_writes=1000):
+        """
+        max_entries
+            Maximum number of indexed keys. Least recently registered keys
+            get evicted first.
+
+        prune_interval
+            Seconds between removal of expired keys from index.
+
+        max_writes
+            Number of recent write operations remembered for checking
+            results of in flight searches. Results of searches started
+            before older write operations get refused.
+        """
+        self.max_entries = max_entries
+        self.prune_interval = prune_interval
+        self.max_writes = max_writes
+        # normalized base DN -> {key: (scope, expires)}
+        self._index = dict()
+        # key -> normalized base DN. Least recently registered first.
+        self._keys = OrderedDict()
+        # recent write operations as (generation, normalized RDN's)
+        self._writes = deque()
+        self._generation = 0
+        self._next_prune = time.time() + prune_interval
+        self._lock = threading.Lock()
+
+    def generation(self):
+        """Return current generation. Pass it to ``register`` for the result
+        of a search started now.
+        """
+        return self._generation
+
+    def register(self, base_dn, scope, key, timeout=0, generation=None):
+        """Register cache key of search with base DN and scope after the
+        result has been cached.
+
+        timeout
+            Lifetime of the cache entry in seconds. 0 means forever.
+
+        generation
+            Generation of the index when the search was started. ``None``
+            means the search was performed after the latest write operation.
+
+        Return list of keys which must be removed from cache. It contains
+        ``key`` itself if a write operation possibly affecting the search
+        happened since ``generation``, and keys evicted from index due to
+        ``max_entries``.
+        """
+        now = time.time()
+        expires = timeout and now + timeout or 0
+        base_rdns = _explode_dn(base_dn)
+        base_dn = ','.join(base_rdns)
+        with self._lock:
+            if generation is not None \
+                    and self._written(base_rdns, scope, generation):
+                self._remove(key)
+                return [key]
+            self._remove(key)
+            self._index.setdefault(base_dn, dict())[key] = (scope, expires)
+            self._keys[key] = base_dn
+            evicted = list()
+            while len(self._keys) > self.max_entries:
+                evicted.append(next(iter(self._keys)))
+                self._remove(evicted[-1])
+            if now >= self._next_prune:
+                evicted += self._prune(now)
+            return evicted
+
+    def affected(self, dn):
+        """Return keys of searches which may be affected by a write operation
+        on DN and remove them from index.
+        """
+        rdns = _explode_dn(dn)
+        keys = list()
+        with self._lock:
+            self._generation += 1
+            self._writes.append((self._generation, rdns))
+            if len(self._writes) > self.max_writes:
+                self._writes.popleft()
+            for i in range(len(rdns) + 1):
+                base_dn = ','.join(rdns[i:])
+                entries = self._index.get(base_dn)
+                if not entries:
+                    continue
+                for key, (scope, expires) in entries.items():
+                    if _affects(i, scope):
+                        keys.append(key)
+                        self._remove(key)
+        return keys
+
+    def clear(self):
+        with self._lock:
+            self._index.clear()
+            self._keys.clear()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _written(self, base_rdns, scope, generation):
+        # check whether a write operation since generation possibly affects
+        # search. Called with lock acquired.
+        if generation >= self._generation:
+            return False
+        if not self._writes or self._writes[0][0] > generation + 1:
+            # write operations got forgotten
+            return True
+        for write_generation, rdns in reversed(self._writes):
+            if write_generation <= generation:
+                break
+            i = len(rdns) - len(base_rdns)
+            if i >= 0 and rdns[i:] == base_rdns and _affects(i, scope):
+                return True
+        return False
+
+    def _remove(self, key):
+        # remove key from index. Called with lock acquired.
+        base_dn = self._keys.pop(key, None)
+        if base_dn is None:
+            return
+        entries = self._index[base_dn]
+        del entries[key]
+        if not entries:
+            del self._index[base_dn]
+
+    def _prune(self, now):
+        # remove expired keys. Called with lock acquired.
+        expired = list()
+        for base_dn, entries in self._index.items():
+            for key, (scope, expires) in entries.items():
+                if expires and expires <= now:
+                    expired.append(key)
+        for key in expired:
+            self._remove(key)
+        self._next_prune = now + self.prune_interval
+        return expired
+
+
+def _affects(depth, scope):
+    # check whether write operation on DN affects search with scope and base
+    # DN ``depth`` levels above. The entry itself is affected by searches of
+    # any scope, parent by ONELEVEL and SUBTREE searches, other ancestors by
+    # SUBTREE searches only.
+    if scope == BASE:
+        return depth == 0
+    if scope == ONELEVEL:
+        return depth <= 1
+    return True
+
+
+# cache indices by cache provider factory
+_cache_indices = weakref.WeakKeyDictionary()
+_cache_indices_lock = threading.Lock()
+
+
+def cache_index_for(cachefactory):
+    """Return ``LDAPCacheIndex`` for cache provider factory.
+
+    All communicators using the same cache provider factory share one index.
+    """
+    with _cache_indices_lock:
+        index = _cache_indices.get(cachefactory)
+        if index is None:
+            index = _cache_indices[cachefactory] = LDAPCacheIndex()
+        return index
+
+
+class CacheEntry(object):
+    """Cached search result which may be served stale.
+
+    Stored in cache instead of the plain result if serving stale results is
+    enabled.
+    """
+
+    def __init__(self, value, fresh_until):
+        self.value = value
+        self.fresh_until = fresh_until
+
+    @property
+    def stale(self):
+        return self.fresh_until <= time.time()
+
+
+class _Call(object):
+    # in flight call of ``SingleFlight``
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Coalesce concurrent calls for the same key.
+
+    While a call for a key is in flight, further calls for this key wait for
+    it and get its result instead of calling the function again.
+    """
+
+    def __init__(self):
+        self._calls = dict()
+        self._lock = threading.Lock()
+
+    def do(self, key, func, args=[], kwargs={}):
+        """Call function for key or wait for the call already in flight.
+
+        Return result of function. Waiting threads get a shallow copy of the
+        result, items of the result are shared. If the function raises, the
+        exception is raised in all waiting threads.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.copy(call.result)
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception, error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    def start(self, key, func, args=[], kwargs={}):
+        """Call function for key in a background thread unless a call for
+        key is in flight.
+
+        Return thread or None if call already in flight.
+        """
+        with self._lock:
+            if key in self._calls:
+                return None
+        thread = threading.Thread(
+            target=self._background,
+            args=(key, func, args, kwargs)
+        )
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _background(self, key, func, args, kwargs):
+        try:
+            self.do(key, func, args, kwargs)
+        except Exception:
+            logger.exception(u"Background call failed.")
+
+
+# coalesces concurrent identical searches of this process
+single_flight = SingleFlight()
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 from .base import encode_utf8
+import re
 
 
 # all special characters except * are escaped, that means * can be
@@ -15,57 +16,596 @@ ESCAPE_CHARS = {
 }
 
 
+# maximum number of memoized parsed and combined filters
+CACHE_SIZE = 1000
+
+
+# ESCAPE_CHARS object, copy of its items and compiled pattern matching them
+_escape_table = [None, None, None]
+
+
+def _escape_pattern():
+    # return pattern matching ESCAPE_CHARS. Gets recompiled if ESCAPE_CHARS
+    # has been replaced or changed.
+    if ESCAPE_CHARS is not _escape_table[0] \
+            or ESCAPE_CHARS != _escape_table[1]:
+        _dict_filters.clear()
+        _escape_table[0] = ESCAPE_CHARS
+        _escape_table[1] = dict(ESCAPE_CHARS)
+        _escape_table[2] = re.compile(
+            '|'.join([re.escape(char) for char in sorted(ESCAPE_CHARS)]))
+    return _escape_table[2]
+
+
+def _escape_char(match):
+    return ESCAPE_CHARS[match.group()]
+
+
+def _escape(value, pattern):
+    if pattern.search(value) is None:
+        return value
+    return pattern.sub(_escape_char, value)
+
+
+def escape(value):
+    """Escape characters of ``ESCAPE_CHARS`` in filter value.
+    """
+    return _escape(encode_utf8(value), _escape_pattern())
+
+
+class FilterNode(object):
+    """Base class of parsed LDAP filters.
+
+    Nodes are immutable and compared by structure, thus they can be used as
+    dictionary keys. The filter string of a node is created once by
+    ``compile``, which subclasses implement.
+    """
+    __slots__ = ('_key', '_hash', '_compiled', '_matcher')
+
+    def __init__(self, key):
+        self._key = key
+        self._hash = hash(key)
+        self._compiled = None
+        self._matcher = None
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        return isinstance(other, FilterNode) and self._key == other._key
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return self._hash
+
+    def __str__(self):
+        if self._compiled is None:
+            self._compiled = self.compile()
+        return self._compiled
+
+    def __repr__(self):
+        return "%s('%s')" % (self.__class__.__name__, str(self))
+
+
+class FilterComposite(FilterNode):
+    """Base class of AND and OR filters.
+    """
+    __slots__ = ('items',)
+    op = None
+
+    def __init__(self, items):
+        self.items = tuple(items)
+        FilterNode.__init__(self, (self.op,) + self.items)
+
+    def compile(self):
+        return '(%s%s)' % (self.op, ''.join([str(_) for _ in self.items]))
+
+
+class FilterAnd(FilterComposite):
+    __slots__ = ()
+    op = '&'
+
+
+class FilterOr(FilterComposite):
+    __slots__ = ()
+    op = '|'
+
+
+class FilterNot(FilterNode):
+    __slots__ = ('item',)
+
+    def __init__(self, item):
+        self.item = item
+        FilterNode.__init__(self, ('!', item))
+
+    def compile(self):
+        return '(!%s)' % (self.item,)
+
+
+class FilterItem(FilterNode):
+    """Attribute value assertion.
+
+    ``op`` is one of ``=``, ``~=``, ``>=``, ``<=`` or ``:=``. ``value`` is
+    the escaped assertion value as contained in the filter string.
+    """
+    __slots__ = ('attr', 'op', 'value')
+
+    def __init__(self, attr, op, value):
+        self.attr = attr
+        self.op = op
+        self.value = value
+        FilterNode.__init__(self, (op, attr, value))
+
+    def compile(self):
+        return '(%s%s%s)' % (self.attr, self.op, self.value)
+
+
+class FilterEquality(FilterItem):
+    __slots__ = ()
+
+    def __init__(self, attr, value):
+        FilterItem.__init__(self, attr, '=', value)
+
+
+class FilterSubstring(FilterItem):
+    __slots__ = ()
+
+    def __init__(self, attr, value):
+        FilterItem.__init__(self, attr, '=', value)
+
+
+class FilterPresence(FilterItem):
+    __slots__ = ()
+
+    def __init__(self, attr):
+        FilterItem.__init__(self, attr, '=', '*')
+
+
+class FilterRaw(FilterNode):
+    """Filter string which cannot be parsed. Used as is.
+    """
+    __slots__ = ('filter',)
+
+    def __init__(self, queryFilter):
+        self.filter = queryFilter
+        FilterNode.__init__(self, ('raw', queryFilter))
+
+    def compile(self):
+        return self.filter
+
+
+def filter_item(attr, value):
+    """Create equality, substring or presence node for escaped value.
+    """
+    if value == '*':
+        return FilterPresence(attr)
+    if '*' in value:
+        return FilterSubstring(attr, value)
+    return FilterEquality(attr, value)
+
+
+# interned composite filters
+_composites = dict()
+
+
+def _compose(factory, items):
+    flattened = list()
+    seen = set()
+    for item in items:
+        if item is None:
+            continue
+        if isinstance(item, factory):
+            children = item.items
+        else:
+            children = (item,)
+        for child in children:
+            if child not in seen:
+                seen.add(child)
+                flattened.append(child)
+    if not flattened:
+        return None
+    if len(flattened) == 1:
+        return flattened[0]
+    node = factory(flattened)
+    existing = _composites.get(node)
+    if existing is not None:
+        return existing
+    if len(_composites) >= CACHE_SIZE:
+        _composites.clear()
+    _composites[node] = node
+    return node
+
+
+def filter_and(*items):
+    """Return node matching all of given nodes.
+
+    Nested AND nodes are flattened, duplicates and None are skipped. Return
+    None if no items given.
+    """
+    return _compose(FilterAnd, items)
+
+
+def filter_or(*items):
+    """Return node matching any of given nodes.
+
+    Nested OR nodes are flattened, duplicates and None are skipped. Return
+    None if no items given.
+    """
+    return _compose(FilterOr, items)
+
+
+# parsed filters by filter string
+_parsed = dict()
+
+
+def parse_filter(queryFilter):
+    """Parse filter string and return ``FilterNode``.
+
+    Result gets memoized. Raise ValueError if filter string is invalid.
+    """
+    node = _parsed.get(queryFilter)
+    if node is not None:
+        return node
+    node, pos = _parse_node(queryFilter, 0)
+    if pos != len(queryFilter):
+        raise ValueError(u"Invalid filter '%s'." % (queryFilter,))
+    if len(_parsed) >= CACHE_SIZE:
+        _parsed.clear()
+    _parsed[queryFilter] = node
+    return node
+
+
+def _parse_node(queryFilter, pos):
+    if queryFilter[pos:pos + 1] != '(':
+        raise ValueError(u"Invalid filter '%s'." % (queryFilter,))
+    op = queryFilter[pos + 1:pos + 2]
+    if op in ('&', '|'):
+        items = list()
+        pos += 2
+        while queryFilter[pos:pos + 1] == '(':
+            item, pos = _parse_node(queryFilter, pos)
+            items.append(item)
+        if not items:
+            raise ValueError(u"Invalid filter '%s'." % (queryFilter,))
+        factory = op == '&' and filter_and or filter_or
+        node = factory(*items)
+    elif op == '!':
+        item, pos = _parse_node(queryFilter, pos + 2)
+        node = FilterNot(item)
+    else:
+        end = queryFilter.find(')', pos)
+        if end == -1:
+            raise ValueError(u"Invalid filter '%s'." % (queryFilter,))
+        node = _parse_item(queryFilter[pos + 1:end])
+        pos = end
+    if queryFilter[pos:pos + 1] != ')':
+        raise ValueError(u"Invalid filter '%s'." % (queryFilter,))
+    return node, pos + 1
+
+
+def _parse_item(item):
+    attr, sep, value = item.partition('=')
+    if not sep or not attr:
+        raise ValueError(u"Invalid filter item '%s'." % (item,))
+    if attr[-1] in '<>~:':
+        return FilterItem(attr[:-1], attr[-1] + '=', value)
+    return filter_item(attr, value)
+
+
+def _filter_node(queryFilter):
+    # return node for LDAPFilter, filter string or node. None if empty
+    if queryFilter is None or isinstance(queryFilter, FilterNode):
+        return queryFilter
+    if isinstance(queryFilter, LDAPFilter):
+        return queryFilter.node
+    if not isinstance(queryFilter, basestring):
+        raise TypeError(u"unsupported operand type")
+    queryFilter = encode_utf8(queryFilter)
+    if not queryFilter:
+        return None
+    try:
+        return parse_filter(queryFilter)
+    except ValueError:
+        return FilterRaw(queryFilter)
+
+
+def _match_all(attrs):
+    return True
+
+
+def _text(value):
+    # value as lower case unicode if possible
+    if not isinstance(value, basestring):
+        value = str(value)
+    if isinstance(value, str):
+        try:
+            value = value.decode('utf-8')
+        except UnicodeDecodeError:
+            # binary value
+            return value
+    return value.lower()
+
+
+def _normalize(value):
+    # value with insignificant spaces removed
+    return u' '.join(_text(value).split())
+
+
+def _unescape(value):
+    # resolve \XX escapes of assertion value
+    if '\\' not in value:
+        return value
+    parts = value.split('\\')
+    res = [parts[0]]
+    for part in parts[1:]:
+        try:
+            res.append(chr(int(part[:2], 16)) + part[2:])
+        except ValueError:
+            raise ValueError(u"Invalid escape in '%s'." % (value,))
+    return ''.join(res)
+
+
+def _compare(value, other):
+    try:
+        return cmp(int(value), int(other))
+    except ValueError:
+        return cmp(_normalize(value), _normalize(other))
+
+
+def _values(attrs, attr):
+    values = attrs.get(attr)
+    if values is None:
+        return ()
+    if not isinstance(values, (list, tuple)):
+        return (values,)
+    return values
+
+
+def _substring_matcher(attr, value):
+    parts = [_text(_unescape(_)) for _ in value.split('*')]
+    initial, middle, final = parts[0], parts[1:-1], parts[-1]
+
+    def match(attrs):
+        for value in _values(attrs, attr):
+            value = _text(value)
+            if not value.startswith(initial):
+                continue
+            pos = len(initial)
+            for part in middle:
+                pos = value.find(part, pos)
+                if pos == -1:
+                    break
+                pos += len(part)
+            if pos != -1 and len(value) - pos >= len(final) \
+                    and value.endswith(final):
+                return True
+        return False
+    return match
+
+
+def _item_matcher(attr, op, value):
+    if op == '>=':
+        def check(value, other):
+            return _compare(value, other) >= 0
+    elif op == '<=':
+        def check(value, other):
+            return _compare(value, other) <= 0
+    else:
+        # equality, approximate match treated as equality
+        value = _normalize(value)
+
+        def check(value, other):
+            return _normalize(value) == other
+
+    def match(attrs):
+        for val in _values(attrs, attr):
+            if check(val, value):
+                return True
+        return False
+    return match
+
+
+def _compile_matcher(node):
+    if isinstance(node, FilterComposite):
+        matchers = [filter_matcher(_) for _ in node.items]
+        if isinstance(node, FilterAnd):
+            def match(attrs):
+                for matcher in matchers:
+                    if not matcher(attrs):
+                        return False
+                return True
+        else:
+            def match(attrs):
+                for matcher in matchers:
+                    if matcher(attrs):
+                        return True
+                return False
+        return match
+    if isinstance(node, FilterNot):
+        matcher = filter_matcher(node.item)
+
+        def match(attrs):
+            return not matcher(attrs)
+        return match
+    if isinstance(node, FilterRaw):
+        raise ValueError(
+            u"Filter '%s' cannot be evaluated locally." % (node.filter,))
+    if node.op == ':=':
+        raise ValueError(u"Extensible match not supported.")
+    attr = node.attr.strip().lower()
+    if isinstance(node, FilterPresence):
+        if attr == 'objectclass':
+            # every entry has an object class
+            return _match_all
+
+        def match(attrs):
+            return bool(_values(attrs, attr))
+        return match
+    if isinstance(node, FilterSubstring):
+        return _substring_matcher(attr, node.value)
+    return _item_matcher(attr, node.op, _unescape(node.value))
+
+
+def filter_matcher(queryFilter):
+    """Return function evaluating filter against entry attributes.
+
+    The function expects a dict of attribute values by lower case attribute
+    name and returns whether the entry matches the filter. Attribute values
+    are compared case insensitive. Ordering is integer based for integer
+    values and string based otherwise.
+
+    Matchers get memoized per filter. Raise ValueError if filter cannot be
+    evaluated locally, e.g. extensible matches.
+    """
+    node = _filter_node(queryFilter)
+    if node is None:
+        return _match_all
+    if node._matcher is None:
+        node._matcher = _compile_matcher(node)
+    return node._matcher
+
+
+def match_filter(queryFilter, attrs):
+    """Return whether entry attributes match filter.
+
+    ``attrs`` is a dict like object containing attribute values, either
+    single values or lists. Attribute names are case insensitive.
+    """
+    matcher = filter_matcher(queryFilter)
+    attrs = dict([(name.lower(), value) for name, value in attrs.items()])
+    return matcher(attrs)
+
+
 class LDAPFilter(object):
 
     def __init__(self, queryFilter=None):
         if queryFilter is not None \
                 and not isinstance(queryFilter, basestring) \
-                and not isinstance(queryFilter, LDAPFilter):
+                and not isinstance(queryFilter, LDAPFilter) \
+                and not isinstance(queryFilter, FilterNode):
             raise TypeError('Query filter must be LDAPFilter or string')
-        queryFilter = encode_utf8(queryFilter)
-        self._filter = queryFilter
-        if isinstance(queryFilter, LDAPFilter):
-            self._filter = str(queryFilter)
+        self._node = _filter_node(queryFilter)
+
+    @property
+    def node(self):
+        """``FilterNode`` of this filter or None if empty.
+        """
+        return self._node
 
     def __and__(self, other):
         if other is None:
             return self
-        res = ''
-        if isinstance(other, LDAPFilter):
-            other = str(other)
-        elif not isinstance(other, basestring):
-            raise TypeError(u"unsupported operand type")
-        us = str(self)
-        if us and other:
-            res = '(&%s%s)' % (us, other)
-        elif us:
-            res = us
-        elif other:
-            res = other
-        return LDAPFilter(res)
+        return LDAPFilter(filter_and(self.node, _filter_node(other)))
 
     def __or__(self, other):
         if other is None:
             return self
-        res = ''
-        if isinstance(other, LDAPFilter):
-            other = str(other)
-        elif not isinstance(other, basestring):
-            raise TypeError(u"unsupported operand type")
-        us = str(self)
-        if us and other:
-            res = '(|%s%s)' % (us, other)
-        return LDAPFilter(res)
+        other = _filter_node(other)
+        us = self.node
+        if us is None or other is None:
+            return LDAPFilter()
+        return LDAPFilter(filter_or(us, other))
+
+    def matches(self, attrs):
+        """Return whether entry attributes match this filter. See
+        ``match_filter``.
+        """
+        return match_filter(self, attrs)
 
     def __contains__(self, attr):
         attr = '(%s=' % (attr,)
-        return attr in self._filter
+        return attr in str(self)
 
     def __str__(self):
-        return self._filter and self._filter or ''
+        node = self.node
+        return node is not None and str(node) or ''
 
     def __repr__(self):
-        return "LDAPFilter('%s')" % (self._filter,)
+        return "LDAPFilter('%s')" % (str(self),)
+
+
+def and_filters(*filters):
+    """Return ``LDAPFilter`` matching all of given filters.
+
+    Filters are LDAPFilter instances, filter strings or nodes. The filter is
+    created in one pass, use this instead of chaining ``&`` for many
+    filters. Empty filters and None are skipped.
+    """
+    return LDAPFilter(filter_and(*[_filter_node(_) for _ in filters]))
+
+
+def or_filters(*filters):
+    """Return ``LDAPFilter`` matching any of given filters.
+
+    Filters are LDAPFilter instances, filter strings or nodes. The filter is
+    created in one pass, use this instead of chaining ``|`` for many
+    filters. None is skipped, an empty filter matches all entries, thus
+    results in an empty filter like ``|`` does.
+    """
+    nodes = list()
+    for queryFilter in filters:
+        if queryFilter is None:
+            continue
+        node = _filter_node(queryFilter)
+        if node is None:
+            return LDAPFilter()
+        nodes.append(node)
+    return LDAPFilter(filter_or(*nodes))
+
+
+def split_filter(queryFilter, size):
+    """Split filter into filters containing OR filters with at most ``size``
+    operands.
+
+    The biggest OR filter not contained in a NOT filter gets split into
+    chunks of ``size`` operands. This is repeated for the resulting filters
+    until none of them contains a bigger OR filter. Entries matching any of
+    the returned filters are the entries matching the given filter. Return
+    list of ``LDAPFilter`` instances, containing given filter only if it
+    needs no splitting or ``size`` is 0.
+    """
+    node = _filter_node(queryFilter)
+    if not size or node is None:
+        return [LDAPFilter(node)]
+    return [LDAPFilter(_) for _ in _split(node, size)]
+
+
+def _split(node, size):
+    # return list of nodes with OR nodes split into chunks of size operands
+    path = _biggest_or(node)
+    if not path or len(path[-1].items) <= size:
+        return [node]
+    items = path[-1].items
+    nodes = list()
+    for i in range(0, len(items), size):
+        target = path[-1]
+        chunk = filter_or(*items[i:i + size])
+        for parent in reversed(path[:-1]):
+            chunk = _compose(parent.__class__, [
+                child is target and chunk or child for child in parent.items
+            ])
+            target = parent
+        # chunk contains less operands than node, recursion terminates
+        nodes.extend(_split(chunk, size))
+    return nodes
+
+
+def _biggest_or(node):
+    # return path from node to biggest OR node not contained in a NOT node,
+    # or None
+    if not isinstance(node, FilterComposite):
+        return None
+    path = None
+    if isinstance(node, FilterOr):
+        path = [node]
+    for child in node.items:
+        child_path = _biggest_or(child)
+        if child_path is None:
+            continue
+        if path is None or len(child_path[-1].items) > len(path[-1].items):
+            path = [node] + child_path
+    return path
 
 
 class LDAPDictFilter(LDAPFilter):
@@ -77,13 +617,14 @@ class LDAPDictFilter(LDAPFilter):
         self.or_keys = or_keys
         self.or_values = or_values
 
-    def __str__(self):
+    @property
+    def node(self):
         if not self.criteria:
-            return ''
-        return str(dict_to_filter(self.criteria,
-                                  or_search=self.or_search,
-                                  or_keys=self.or_keys,
-                                  or_values=self.or_values))
+            return None
+        return dict_to_filter(self.criteria,
+                              or_search=self.or_search,
+                              or_keys=self.or_keys,
+                              or_values=self.or_values).node
 
     def __repr__(self):
         return "LDAPDictFilter(criteria=%r)" % (self.criteria,)
@@ -96,8 +637,9 @@ class LDAPRelationFilter(LDAPFilter):
         self.gattrs = node.attrs
         self.or_search = or_search
 
-    def __str__(self):
-        """turn relation string into ldap filter string
+    @property
+    def node(self):
+        """turn relation string into ldap filter
         """
         dictionary = dict()
 
@@ -129,45 +671,83 @@ class LDAPRelationFilter(LDAPFilter):
         #     _filter = dict_to_filter(parsedRelation, self.or_search)
 
         if self.dictionary:
-            return str(dict_to_filter(self.dictionary, self.or_search))
-        return ''
+            return dict_to_filter(self.dictionary, self.or_search).node
+        return None
 
     def __repr__(self):
         return "LDAPRelationFilter('%s')" % (str(self),)
 
 
+# filter nodes by criteria
+_dict_filters = dict()
+
+
+def _criteria_key(criteria, or_search, or_keys, or_values):
+    # hashable key of criteria or None
+    items = list()
+    for attr, values in criteria.items():
+        if isinstance(values, list):
+            values = tuple([(type(_), _) for _ in values])
+        else:
+            values = (type(values), values)
+        items.append((attr, values))
+    key = (tuple(items), or_search, or_keys, or_values)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _values_node(attr, values, or_values, pattern):
+    # create filter node for attribute values. attribute name gets escaped
+    # once, node is created in one pass.
+    attr = _escape(encode_utf8(attr), pattern)
+    items = list()
+    for value in values:
+        if isinstance(value, unicode):
+            value = encode_utf8(value)
+        if isinstance(value, str):
+            value = _escape(value, pattern)
+        items.append(filter_item(attr, str(value)))
+    if or_values:
+        return filter_or(*items)
+    return filter_and(*items)
+
+
+def values_filter(attr, values, or_values=True):
+    """Create filter for values of attribute.
+
+    Values are ORed by default. Attribute name gets escaped once and values
+    are escaped with a precompiled pattern, thus building filters for
+    thousands of values, e.g. member DN's of a group, is done in linear time.
+    """
+    return LDAPFilter(_values_node(attr, values, or_values, _escape_pattern()))
+
+
 def dict_to_filter(criteria, or_search=False, or_keys=None, or_values=None):
     """Turn dictionary criteria into ldap queryFilter string
+
+    Resulting filters get memoized by criteria.
     """
+    # get pattern first, memoized filters are cleared if ESCAPE_CHARS changed
+    pattern = _escape_pattern()
+    key = _criteria_key(criteria, or_search, or_keys, or_values)
+    if key is not None and key in _dict_filters:
+        return LDAPFilter(_dict_filters[key])
     or_keys = (or_keys is None) and or_search or or_keys
     or_values = (or_values is None) and or_search or or_values
-    _filter = None
+    attrfilters = list()
     for attr, values in criteria.items():
-        attr = encode_utf8(attr)
         if not isinstance(values, list):
             values = [values]
-        attrfilter = None
-        for value in values:
-            if isinstance(value, unicode):
-                value = encode_utf8(value)
-            attr = ''.join(map(lambda x: ESCAPE_CHARS.get(x, x), attr))
-            if isinstance(value, str):
-                value = ''.join(map(lambda x: ESCAPE_CHARS.get(x, x), value))
-            valuefilter = LDAPFilter('(%s=%s)' % (attr, value))
-            if attrfilter is None:
-                attrfilter = valuefilter
-                continue
-            if or_values:
-                attrfilter |= valuefilter
-            else:
-                attrfilter &= valuefilter
-        if _filter is None:
-            _filter = attrfilter
-            continue
-        if or_keys:
-            _filter |= attrfilter
-        else:
-            _filter &= attrfilter
-    if _filter is None:
-        _filter = LDAPFilter()
-    return _filter
+        attrfilters.append(_values_node(attr, values, or_values, pattern))
+    if or_keys:
+        _filter = filter_or(*attrfilters)
+    else:
+        _filter = filter_and(*attrfilters)
+    if key is not None:
+        if len(_dict_filters) >= CACHE_SIZE:
+            _dict_filters.clear()
+        _dict_filters[key] = _filter
+    return LDAPFilter(_filter)
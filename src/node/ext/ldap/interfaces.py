@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+from bda.cache.interfaces import ICacheProvider
 from node.interfaces import INodeAddedEvent
 from node.interfaces import INodeCreatedEvent
 from node.interfaces import INodeDetachedEvent
@@ -19,6 +20,53 @@ class ICacheProviderFactory(Interface):
         """
 
 
+class IHashableKeyCacheProvider(ICacheProvider):
+    """Marker for cache providers accepting any hashable object as key.
+
+    Cache keys are not required to be hashed to strings for such providers.
+    """
+
+
+class ILRUCacheProvider(IHashableKeyCacheProvider):
+    """In-process cache provider with least recently used eviction.
+    """
+
+    hits = Attribute(u'Number of cache hits.')
+
+    misses = Attribute(u'Number of cache misses.')
+
+    evictions = Attribute(u'Number of entries evicted due to size bounds.')
+
+    expirations = Attribute(u'Number of entries dropped due to timeout.')
+
+    def set(key, value, timeout=None):
+        """Store value by key. ``timeout`` defines the lifetime of this
+        entry in seconds, 0 means forever. Defaults to provider timeout.
+        """
+
+    def stats():
+        """Return dict containing counters and current size.
+        """
+
+
+class ITwoTierCacheProvider(IHashableKeyCacheProvider):
+    """Cache provider consulting an in-process cache before a remote cache.
+    """
+
+    local = Attribute(u'``ILRUCacheProvider`` implementation.')
+
+    remote = Attribute(u'Remote ``ICacheProvider`` implementation.')
+
+    local_timeout = Attribute(
+        u'Maximum lifetime of entries in the local cache in seconds.'
+    )
+
+    def set(key, value, timeout=None):
+        """Store value by key in both caches. ``timeout`` defines the
+        lifetime of the entry in the remote cache.
+        """
+
+
 class ILDAPProps(Interface):
     """LDAP properties configuration interface.
     """
@@ -55,6 +103,49 @@ class ILDAPProps(Interface):
 
     page_size = Attribute(u'Page size for LDAP queries.')
 
+    pool_min_size = Attribute(u'Minimum number of pooled connections')
+
+    pool_max_size = Attribute(
+        u'Maximum number of pooled connections. 0 disables pooling')
+
+    pool_idle_timeout = Attribute(
+        u'Seconds after which idle pooled connections get closed')
+
+    pool_check_interval = Attribute(
+        u'Seconds of idle time after which pooled connections get health '
+        u'checked on checkout')
+
+    pool_checkout_timeout = Attribute(
+        u'Seconds to wait for a free pooled connection')
+
+    pool_reserve_timeout = Attribute(
+        u'Seconds a pooled connection stays reserved for continuing a paged '
+        u'search')
+
+    auth_pool_size = Attribute(
+        u'Maximum number of pooled connections for credential checks. 0 '
+        u'disables pooling')
+
+    cache_stale_timeout = Attribute(
+        u'Seconds expired cached search results are served while being '
+        u'refreshed. 0 disables')
+
+    negative_cache_timeout = Attribute(
+        u'Seconds inexistent DNs and principal ids are remembered. 0 disables')
+
+    negative_cache_size = Attribute(
+        u'Maximum number of entries in negative cache')
+
+    cache_compact = Attribute(
+        u'Flag whether cached search results are stored compact')
+
+    cache_compress_threshold = Attribute(
+        u'Size in bytes above which compact encoded search results get '
+        u'compressed')
+
+    filter_chunk_size = Attribute(
+        u'Maximum number of operands of an OR filter in node searches')
+
 
 class ILDAPPrincipalsConfig(Interface):
     """LDAP principals configuration interface.
@@ -141,12 +232,18 @@ class ILDAPStorage(IStorage):
         u'on __setitem__ if not present yet.'
     )
 
+    prefetch = Attribute(
+        u'Flag whether children attributes are fetched along with the keys '
+        u'when iterating the node.'
+    )
+
     def child_dn(key):
         """Return child DN for ``key``.
         """
 
     def search(queryFilter=None, criteria=None, relation=None,
-               attrlist=None, exact_match=False, or_search=False):
+               attrlist=None, exact_match=False, or_search=False,
+               snapshot=False):
         """Search the directors.
 
         All search criteria are additive and will be ``&``ed. ``queryFilter``
@@ -185,9 +282,28 @@ class ILDAPStorage(IStorage):
 
         or_search
             flag whether criteria should be ORer or ANDed. defaults to False.
+
+        snapshot
+            flag whether to evaluate the filter against the nodes in memory
+            instead of searching the directory. The directory is searched
+            anyway if children of nodes within search scope have not been
+            loaded by iterating, or if attributes of a node within search
+            scope are not loaded. defaults to False.
+
+        If ``filter_chunk_size`` is set on props, filters containing bigger OR
+        filters, e.g. for criteria with many values, are split into several
+        searches sent at once. Results are merged, paged searches page over
+        the merged results. Merged results, as well as results answered from
+        a snapshot, are kept on the returned cookie, thus subsequent pages do
+        not search again.
         """
 
 
+class ILDAPReadOnly(Interface):
+    """Marker for LDAP nodes which cannot be modified.
+    """
+
+
 ###############################################################################
 # events
 ###############################################################################
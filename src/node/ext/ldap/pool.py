@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager
+import ldap
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger('node.ext.ldap')
+
+
+class LDAPConnectionPool(object):
+    """Thread safe pool of bound LDAP connections.
+
+    Connections are handed out by ``checkout`` and must be given back with
+    ``checkin``, or ``discard`` if they turned out to be broken. Use the
+    ``connection`` context manager to get both right.
+
+    Connections can be reserved for a key on checkin. A subsequent checkout
+    with the same key returns the reserved connection. This is used for
+    paged searches, since the paging cookie is only valid on the connection
+    it was issued on.
+    """
+
+    def __init__(self, connect, min_size=0, max_size=10, idle_timeout=300.0,
+                 check_interval=30.0, checkout_timeout=30.0,
+                 reserve_timeout=60.0):
+        """
+        connect
+            Callable returning a new bound LDAP connection object.
+
+        min_size
+            Number of connections kept open even if idle.
+
+        max_size
+            Maximum number of connections opened at a time.
+
+        idle_timeout
+            Seconds after which an idle connection gets closed.
+
+        check_interval
+            Connections idle for longer than this amount of seconds get health
+            checked on checkout. 0 checks on every checkout.
+
+        checkout_timeout
+            Seconds to wait for a connection if all connections are in use.
+            ``None`` waits forever.
+
+        reserve_timeout
+            Seconds a connection stays reserved for a key. Afterwards it is
+            considered idle, e.g. if a paged search has been abandoned.
+        """
+        if max_size < 1 or min_size > max_size:
+            raise ValueError(u"Invalid pool size.")
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self.checkout_timeout = checkout_timeout
+        self.reserve_timeout = reserve_timeout
+        # idle connections as list of (connection, last_used) tuples. Most
+        # recently used connections are at the end of the list.
+        self._idle = list()
+        # reserved connections as dict of key -> (connection, last_used)
+        self._reserved = dict()
+        # total number of open connections, including the ones in use
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition(threading.Lock())
+        for i in range(min_size):
+            con = self._create()
+            with self._cond:
+                self._idle.append((con, time.time()))
+
+    @property
+    def size(self):
+        """Number of open connections.
+        """
+        return self._size
+
+    @property
+    def idle(self):
+        """Number of idle connections.
+        """
+        return len(self._idle)
+
+    def checkout(self, key=None):
+        """Return a connection from the pool.
+
+        key
+            Return the connection reserved for key if any.
+        """
+        timeout = self.checkout_timeout
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self._cond:
+                expired = self._expire()
+                con = last_used = None
+                while True:
+                    if self._closed:
+                        raise RuntimeError(u"Connection pool closed.")
+                    if key is not None and key in self._reserved:
+                        con, last_used = self._reserved.pop(key)
+                        break
+                    if self._idle:
+                        con, last_used = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        # reserve slot, connection gets created below
+                        self._size += 1
+                        break
+                    if deadline is None:
+                        self._cond.wait()
+                        continue
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise RuntimeError(u"Connection pool exhausted.")
+                    self._cond.wait(remaining)
+            self._close_all(expired)
+            if con is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    self._release_slot()
+                    raise
+            if time.time() - last_used < self.check_interval \
+                    or self._check(con):
+                return con
+            logger.warning(u"Discard broken pooled LDAP connection.")
+            self.discard(con)
+
+    def checkin(self, con, key=None):
+        """Give back a connection to the pool.
+
+        key
+            Reserve connection for key. A connection already reserved for key
+            gets closed.
+        """
+        displaced = con
+        with self._cond:
+            if self._closed:
+                self._size -= 1
+            else:
+                displaced = None
+                if key is not None:
+                    if key in self._reserved:
+                        # key collides with a pending reservation. The
+                        # displaced connection gets closed, its paged search
+                        # cannot be continued anymore.
+                        displaced = self._reserved[key][0]
+                        self._size -= 1
+                    self._reserved[key] = (con, time.time())
+                else:
+                    self._idle.append((con, time.time()))
+                self._cond.notify()
+        if displaced is not None:
+            self._close(displaced)
+
+    def discard(self, con):
+        """Close a connection and remove it from the pool.
+        """
+        self._release_slot()
+        self._close(con)
+
+    @contextmanager
+    def connection(self, key=None):
+        """Context manager for checking out and in a connection.
+
+        Connections get discarded if the server went away.
+        """
+        con = self.checkout(key=key)
+        try:
+            yield con
+        except (ldap.SERVER_DOWN, ldap.CONNECT_ERROR):
+            self.discard(con)
+            raise
+        except Exception:
+            self.checkin(con)
+            raise
+        self.checkin(con)
+
+    def close(self):
+        """Close all idle and reserved connections.
+
+        Connections currently in use get closed on checkin.
+        """
+        with self._cond:
+            self._closed = True
+            cons = [con for con, _ in self._idle]
+            cons += [con for con, _ in self._reserved.values()]
+            self._size -= len(cons)
+            self._idle = list()
+            self._reserved = dict()
+            self._cond.notify_all()
+        self._close_all(cons)
+
+    def _create(self):
+        # create a new connection and count it
+        con = self._connect()
+        with self._cond:
+            self._size += 1
+        return con
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _expire(self):
+        # remove idle connections exceeding idle timeout and reservations
+        # exceeding their lifetime. Called with lock acquired. Return
+        # connections to close.
+        now = time.time()
+        for key, (con, last_used) in self._reserved.items():
+            if now - last_used >= self.reserve_timeout:
+                # paged search has been abandoned
+                del self._reserved[key]
+                self._idle.append((con, last_used))
+        self._idle.sort(key=lambda x: x[1])
+        expired = list()
+        while self._idle and self._size > self.min_size:
+            con, last_used = self._idle[0]
+            if now - last_used < self.idle_timeout:
+                break
+            del self._idle[0]
+            self._size -= 1
+            expired.append(con)
+        return expired
+
+    def _check(self, con):
+        # health check a connection
+        try:
+            con.whoami_s()
+        except ldap.LDAPError:
+            return False
+        return True
+
+    def _close(self, con):
+        try:
+            con.unbind_s()
+        except ldap.LDAPError:
+            pass
+
+    def _close_all(self, cons):
+        for con in cons:
+            self._close(con)
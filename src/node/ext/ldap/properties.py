@@ -52,7 +52,20 @@ class LDAPServerProperties(object):
         retry_delay=10.0,
         multivalued_attributes=MULTIVALUED_DEFAULTS,
         binary_attributes=BINARY_DEFAULTS,
-        page_size=1000
+        page_size=1000,
+        pool_min_size=0,
+        pool_max_size=0,
+        pool_idle_timeout=300.0,
+        pool_check_interval=30.0,
+        pool_checkout_timeout=30.0,
+        pool_reserve_timeout=60.0,
+        auth_pool_size=0,
+        cache_stale_timeout=0,
+        negative_cache_timeout=0,
+        negative_cache_size=1000,
+        cache_compact=False,
+        cache_compress_threshold=4096,
+        filter_chunk_size=0
     ):
         """Take the connection properties as arguments.
 
@@ -133,6 +146,65 @@ class LDAPServerProperties(object):
             Number of objects requested at once.
             In iterations after this number of objects a new search query is
             sent for the next batch using returned the LDAP cookie.
+
+        pool_min_size
+            Number of pooled connections kept open even if idle. Only takes
+            effect if pooling is enabled, defaults to 0.
+
+        pool_max_size
+            Maximum number of pooled connections. If 0, pooling is disabled
+            and a single connection is used. Defaults to 0.
+
+        pool_idle_timeout
+            Seconds after which idle pooled connections get closed, defaults
+            to 300.
+
+        pool_check_interval
+            Pooled connections idle for longer than this amount of seconds
+            get health checked on checkout, defaults to 30.
+
+        pool_checkout_timeout
+            Seconds to wait for a free connection if all pooled connections
+            are in use. ``None`` waits forever. Defaults to 30.
+
+        pool_reserve_timeout
+            Seconds a pooled connection stays reserved for continuing a paged
+            search, defaults to 60.
+
+        auth_pool_size
+            Maximum number of pooled connections used for credential checks
+            in ``LDAPSession.authenticate``. If 0, a new connection is opened
+            for every check. Defaults to 0.
+
+        cache_stale_timeout
+            Seconds expired cached search results are still served while being
+            refreshed in the background. 0 disables serving stale results. Only
+            takes effect if cache is enabled, defaults to 0.
+
+        negative_cache_timeout
+            Seconds inexistent DNs and principal ids are remembered, avoiding
+            repeated searches for them. Writes through the session reset
+            remembered entries. 0 disables the negative cache, defaults to 0.
+
+        negative_cache_size
+            Maximum number of remembered inexistent DNs and principal ids,
+            defaults to 1000.
+
+        cache_compact
+            Flag whether cached search results are stored in a compact
+            encoding. Attribute names and DN suffixes are stored only once per
+            result. Only takes effect if cache is enabled, defaults to False.
+
+        cache_compress_threshold
+            Compact encoded search results bigger than this number of bytes get
+            zlib compressed. 0 disables compression, defaults to 4096.
+
+        filter_chunk_size
+            Maximum number of operands of an OR filter in searches of
+            ``LDAPNode``, e.g. for criteria with many values of one attribute.
+            Searches with bigger OR filters get split into several searches,
+            which are sent to the server at once. Results get merged. 0
+            disables splitting, defaults to 0.
         """
         if uri is None:
             # old school
@@ -155,5 +227,18 @@ class LDAPServerProperties(object):
         self.multivalued_attributes = multivalued_attributes
         self.binary_attributes = binary_attributes
         self.page_size = page_size
+        self.pool_min_size = pool_min_size
+        self.pool_max_size = pool_max_size
+        self.pool_idle_timeout = pool_idle_timeout
+        self.pool_check_interval = pool_check_interval
+        self.pool_checkout_timeout = pool_checkout_timeout
+        self.pool_reserve_timeout = pool_reserve_timeout
+        self.auth_pool_size = auth_pool_size
+        self.cache_stale_timeout = cache_stale_timeout
+        self.negative_cache_timeout = negative_cache_timeout
+        self.negative_cache_size = negative_cache_size
+        self.cache_compact = cache_compact
+        self.cache_compress_threshold = cache_compress_threshold
+        self.filter_chunk_size = filter_chunk_size
 
 LDAPProps = LDAPServerProperties
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+from node.ext.ldap.base import LDAPCommunicator
+from node.ext.ldap.base import LDAPConnector
+from node.ext.ldap.cache import _explode_dn
+from node.ext.ldap.filter import filter_matcher
+from node.ext.ldap.scope import BASE
+from node.ext.ldap.scope import ONELEVEL
+from node.ext.ldap.scope import SUBTREE
+import ldap
+import threading
+
+
+# well known operational attributes. Searches requesting them are not
+# answered by replicas not mirroring them
+OPERATIONAL_ATTRIBUTES = frozenset([
+    'createtimestamp',
+    'creatorsname',
+    'modifytimestamp',
+    'modifiersname',
+    'entryuuid',
+    'entrydn',
+    'entrycsn',
+    'contextcsn',
+    'hassubordinates',
+    'numsubordinates',
+    'subschemasubentry',
+    'structuralobjectclass',
+    'memberof',
+    'ismemberof',
+    'pwdchangedtime',
+    'pwdaccountlockedtime',
+    'pwdfailuretime',
+    'pwdhistory',
+    'pwdgraceusetime',
+    'pwdreset',
+    'pwdpolicysubentry',
+    'nsuniqueid',
+    'nsaccountlock',
+])
+
+
+# registered replicas by (uri, user)
+_replicas = dict()
+_replicas_lock = threading.Lock()
+
+
+def register_replica(replica):
+    """Register replica. Sessions created with props of same URI and user
+    answer searches within the replica base DN from it.
+    """
+    with _replicas_lock:
+        _replicas.setdefault(replica.registry_key, list()).append(replica)
+
+
+def unregister_replica(replica):
+    with _replicas_lock:
+        replicas = _replicas.get(replica.registry_key, list())
+        if replica in replicas:
+            replicas.remove(replica)
+        if not replicas:
+            _replicas.pop(replica.registry_key, None)
+
+
+def lookup_replica(props, baseDN):
+    """Return loaded replica containing ``baseDN`` or None.
+    """
+    replicas = _replicas.get((props.uri, props.user))
+    if not replicas or not baseDN:
+        return None
+    key = _dn_key(baseDN)
+    for replica in replicas:
+        if replica.loaded and replica.contains(key):
+            return replica
+    return None
+
+
+def _dn_key(dn):
+    # normalized DN as tuple of RDN's
+    return tuple(_explode_dn(dn))
+
+
+class LDAPReplica(object):
+    """In memory copy of a subtree of the directory.
+
+    Gets loaded with a paged search and updated either by ``poll``, fetching
+    entries modified since the last update, or by calling ``update`` with the
+    DN of changed entries, e.g. as subscriber of
+    ``node.ext.ldap.sync.LDAPChangeListener``.
+
+    Searches get evaluated locally. Attribute names and values are compared
+    case insensitive, ordering is integer based for integer values and string
+    based otherwise. Extensible match filters are not supported.
+    """
+
+    def __init__(self, props, baseDN, operational=('memberOf',),
+                 page_size=1000, detect_deletes=True):
+        """
+        props
+            ``LDAPProps`` instance.
+
+        baseDN
+            Base DN of the mirrored subtree.
+
+        operational
+            Names of operational attributes to mirror. Other operational
+            attributes are not available from the replica.
+
+        page_size
+            Page size used for loading and polling.
+
+        detect_deletes
+            Flag whether ``poll`` lists all DN's of the subtree to detect
+            deleted entries.
+        """
+        self.props = props
+        self.baseDN = baseDN
+        self.operational = [name.lower() for name in operational]
+        self.page_size = page_size
+        self.detect_deletes = detect_deletes
+        self.loaded = False
+        self._base = _dn_key(baseDN)
+        self._attrlist = ['*', 'modifyTimestamp'] + list(operational)
+        self._communicator = LDAPCommunicator(LDAPConnector(props=props))
+        self._lock = threading.RLock()
+        # normalized DN -> (dn, attrs, attrs by lower case name)
+        self._entries = dict()
+        # normalized DN -> set of normalized child DN's
+        self._children = dict()
+        # latest known modifyTimestamp
+        self._timestamp = None
+
+    @property
+    def registry_key(self):
+        return (self.props.uri, self.props.user)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def contains(self, key):
+        """Return whether normalized DN ``key`` is within replica subtree.
+        """
+        return len(key) >= len(self._base) \
+            and key[len(key) - len(self._base):] == self._base
+
+    def load(self):
+        """Load whole subtree from directory.
+        """
+        res = self._search_iter('(objectClass=*)', SUBTREE, self.baseDN,
+                                self._attrlist, self.page_size)
+        with self._lock:
+            self._entries = dict()
+            self._children = dict()
+            self._timestamp = None
+            for dn, attrs in res:
+                self._store(dn, attrs)
+            self.loaded = True
+
+    def poll(self):
+        """Fetch entries modified since last update. Loads the replica if not
+        loaded yet.
+        """
+        if not self.loaded or self._timestamp is None:
+            self.load()
+            return
+        query = '(modifyTimestamp>=%s)' % self._timestamp
+        res = self._search_iter(query, SUBTREE, self.baseDN, self._attrlist,
+                                self.page_size)
+        with self._lock:
+            for dn, attrs in res:
+                self._store(dn, attrs)
+        if not self.detect_deletes:
+            return
+        res = self._search_iter('(objectClass=*)', SUBTREE, self.baseDN,
+                                ['1.1'], self.page_size)
+        present = set([_dn_key(dn) for dn, attrs in res])
+        with self._lock:
+            for key in set(self._entries) - present:
+                self._remove(key)
+
+    def update(self, dn):
+        """Fetch entry with ``dn`` from directory. Removes it from replica if
+        it does not exist any longer.
+        """
+        if not self.contains(_dn_key(dn)):
+            return
+        try:
+            res = self._search_iter('(objectClass=*)', BASE, dn,
+                                    self._attrlist)
+        except ldap.NO_SUCH_OBJECT:
+            res = list()
+        with self._lock:
+            if res:
+                self._store(*res[0])
+            else:
+                self._remove(_dn_key(dn))
+
+    def search(self, queryFilter='(objectClass=*)', scope=BASE, baseDN=None,
+               attrlist=None, attrsonly=0):
+        """Search replica. Signature and result format are the same as of
+        ``LDAPSession.search`` without paging.
+
+        Raise ValueError if filter or attrlist is not supported, e.g. if
+        operational attributes not mirrored are requested, and
+        ``ldap.NO_SUCH_OBJECT`` if base DN does not exist.
+        """
+        matcher = filter_matcher(queryFilter or '(objectClass=*)')
+        if attrlist:
+            self._check_attrlist(attrlist)
+        if baseDN is None:
+            baseDN = self.baseDN
+        base = _dn_key(baseDN)
+        with self._lock:
+            if base not in self._entries:
+                raise ldap.NO_SUCH_OBJECT({
+                    'desc': 'No such object',
+                    'matched': self.baseDN,
+                })
+            if scope == BASE:
+                keys = [base]
+            elif scope == ONELEVEL:
+                keys = self._children.get(base, ())
+            elif scope == SUBTREE:
+                keys = self._subtree(base)
+            else:
+                raise ValueError(u"Invalid scope '%s'." % (scope,))
+            res = list()
+            for key in keys:
+                dn, attrs, lowered = self._entries[key]
+                if matcher(lowered):
+                    res.append(
+                        (dn, self._select(attrs, attrlist, attrsonly)))
+        return res
+
+    def _search_iter(self, queryFilter, scope, baseDN, attrlist,
+                     page_size=None):
+        if not self._communicator.bound:
+            self._communicator.bind()
+        return list(self._communicator.search_iter(
+            queryFilter, scope, baseDN, attrlist, page_size=page_size))
+
+    def _store(self, dn, attrs):
+        # called with lock acquired
+        if dn is None:
+            return
+        key = _dn_key(dn)
+        lowered = dict()
+        for name, values in attrs.items():
+            lowered[name.lower()] = values
+        timestamp = lowered.get('modifytimestamp')
+        if timestamp and timestamp[0] > self._timestamp:
+            self._timestamp = timestamp[0]
+        self._entries[key] = (dn, attrs, lowered)
+        if key != self._base:
+            self._children.setdefault(key[1:], set()).add(key)
+
+    def _remove(self, key):
+        # called with lock acquired
+        for child in list(self._children.get(key, ())):
+            self._remove(child)
+        self._children.pop(key, None)
+        if self._entries.pop(key, None) is not None:
+            siblings = self._children.get(key[1:])
+            if siblings is not None:
+                siblings.discard(key)
+
+    def _subtree(self, base):
+        keys = [base]
+        stack = [base]
+        while stack:
+            children = self._children.get(stack.pop(), ())
+            keys.extend(children)
+            stack.extend(children)
+        return keys
+
+    def _check_attrlist(self, attrlist):
+        # raise ValueError if operational attributes not mirrored are
+        # requested
+        for name in attrlist:
+            if name == '+':
+                raise ValueError(u"Operational attributes not supported.")
+            lowered = name.lower()
+            if lowered in OPERATIONAL_ATTRIBUTES \
+                    and lowered not in self.operational \
+                    and lowered != 'modifytimestamp':
+                raise ValueError(
+                    u"Operational attribute '%s' not mirrored." % (name,))
+
+    def _select(self, attrs, attrlist, attrsonly):
+        # return copy of entry attributes requested by attrlist
+        if not attrlist:
+            attrlist = ['*']
+        wanted = set([name.lower() for name in attrlist])
+        everything = '*' in wanted
+        selected = dict()
+        for name, values in attrs.items():
+            lowered = name.lower()
+            if lowered in wanted:
+                pass
+            elif not everything or lowered in self.operational \
+                    or lowered == 'modifytimestamp':
+                continue
+            selected[name] = not attrsonly and list(values) or list()
+        return selected
@@ -3,9 +3,17 @@ from node.ext.ldap import BASE
 from node.ext.ldap import LDAPCommunicator
 from node.ext.ldap import LDAPConnector
 from node.ext.ldap import testLDAPConnectivity
+from node.ext.ldap.cache import LRUCache
+from node.ext.ldap.replica import lookup_replica
 import ldap
 
 
+class _ReplicaCookie(str):
+    # paging cookie of search answered by a replica. Value is the offset of
+    # the next page
+    pass
+
+
 class LDAPSession(object):
     """LDAP Session binds always.
 
@@ -16,6 +24,16 @@ class LDAPSession(object):
         self._props = props
         connector = LDAPConnector(props=props)
         self._communicator = LDAPCommunicator(connector)
+        self._auth_pool = connector.auth_pool()
+        # remembers keys known to not exist in the directory
+        self._negative_cache = None
+        timeout = getattr(props, 'negative_cache_timeout', 0)
+        if timeout:
+            self._negative_cache = LRUCache(
+                max_entries=getattr(props, 'negative_cache_size', 1000),
+                max_bytes=0,
+                timeout=timeout
+            )
 
     def checkServerProperties(self):
         """Test if connection can be established.
@@ -43,9 +61,26 @@ class LDAPSession(object):
         XXX: * Improve retry logic
              * Extend LDAPSession object to handle Fallback server(s)
         """
-        if self._communicator._con is None:
+        if not self._communicator.bound:
             self._communicator.bind()
 
+    def missing(self, key):
+        """Return whether key has been marked missing by ``set_missing``.
+
+        Always False if negative cache is disabled.
+        """
+        if self._negative_cache is None:
+            return False
+        return self._negative_cache.get(key) is not None
+
+    def set_missing(self, key):
+        """Remember key as not existing in the directory, e.g. a DN or a
+        principal id. Entries expire after ``negative_cache_timeout`` seconds
+        and are reset on every write operation through this session.
+        """
+        if self._negative_cache is not None:
+            self._negative_cache[key] = True
+
     def search(self, queryFilter='(objectClass=*)', scope=BASE, baseDN=None,
                force_reload=False, attrlist=None, attrsonly=0,
                page_size=None, cookie=None):
@@ -54,6 +89,19 @@ class LDAPSession(object):
             # interpret them as "don't filter" which in LDAP terms is
             # '(objectClass=*)'
             queryFilter = '(objectClass=*)'
+        if isinstance(cookie, _ReplicaCookie):
+            # continue paged search answered by replica. Fetches the result
+            # as a whole from server if replica is not available any more
+            res = self.search(queryFilter, scope, baseDN, force_reload,
+                              attrlist, attrsonly)
+            return self._replica_page(res, page_size, int(cookie))
+        if not force_reload and not cookie:
+            res = self._replica_search(queryFilter, scope, baseDN, attrlist,
+                                       attrsonly)
+            if res is not None:
+                if page_size:
+                    return self._replica_page(res, page_size, 0)
+                return res
         self.ensure_connection()
         res = self._communicator.search(queryFilter, scope, baseDN,
                                         force_reload, attrlist, attrsonly,
@@ -66,20 +114,107 @@ class LDAPSession(object):
             return res, cookie
         return res
 
+    def search_many(self, queries, force_reload=False):
+        """Perform several searches at once. See
+        ``node.ext.ldap.base.LDAPCommunicator.search_many``.
+        """
+        results = [None] * len(queries)
+        remote = list()
+        for i, query in enumerate(queries):
+            res = None
+            if not force_reload:
+                try:
+                    res = self._replica_search(
+                        query.get('queryFilter') or '(objectClass=*)',
+                        query.get('scope', BASE),
+                        query.get('baseDN'),
+                        query.get('attrlist'),
+                        query.get('attrsonly', 0),
+                    )
+                except ldap.LDAPError, e:
+                    res = e
+            if res is None:
+                remote.append(i)
+            results[i] = res
+        if remote:
+            self.ensure_connection()
+            remote_results = self._communicator.search_many(
+                [queries[i] for i in remote], force_reload)
+            for i, res in zip(remote, remote_results):
+                results[i] = res
+        # ActiveDirectory returns entries with dn None, which can be ignored
+        return [
+            filter(lambda x: x[0] is not None, res)
+            if isinstance(res, list) else res for res in results
+        ]
+
+    def _replica_search(self, queryFilter, scope, baseDN, attrlist,
+                        attrsonly):
+        # answer search from registered replica containing search base.
+        # Return None if not possible.
+        if baseDN is None:
+            baseDN = self._communicator.baseDN
+        replica = lookup_replica(self._props, baseDN)
+        if replica is None:
+            return None
+        try:
+            return replica.search(queryFilter, scope, baseDN, attrlist,
+                                  attrsonly)
+        except ValueError:
+            # filter not supported by replica
+            return None
+
+    def _replica_page(self, res, page_size, offset):
+        # return page of search result answered by replica and cookie
+        end = offset + page_size
+        cookie = end < len(res) and _ReplicaCookie(end) or ''
+        return res[offset:end], cookie
+
+    def _replica_update(self, dn):
+        # keep replica containing DN up to date with writes of this session
+        replica = lookup_replica(self._props, dn)
+        if replica is not None:
+            replica.update(dn)
+
+    def search_iter(self, queryFilter='(objectClass=*)', scope=BASE,
+                    baseDN=None, attrlist=None, attrsonly=0, page_size=None):
+        """Search generator yielding result entries as they arrive from the
+        server. Results are not cached.
+        """
+        if not queryFilter:
+            queryFilter = '(objectClass=*)'
+        self.ensure_connection()
+        res = self._communicator.search_iter(queryFilter, scope, baseDN,
+                                             attrlist, attrsonly, page_size)
+        for entry in res:
+            # ActiveDirectory returns entries with dn None, which can be
+            # ignored
+            if entry[0] is not None:
+                yield entry
+
     def add(self, dn, data):
         self.ensure_connection()
         self._communicator.add(dn, data)
+        self._reset_missing()
+        self._replica_update(dn)
 
     def authenticate(self, dn, pw):
         """Verify credentials, but don't rebind the session to that user
+
+        If ``auth_pool_size`` is set on props, connections used for credential
+        checks are taken from a pool and get rebound for every check.
+        Otherwise a dedicated connection is opened and closed again.
         """
-        # Let's bypass connector/communicator until they are sorted out
-        if self._props.ignore_cert:
-            ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER)
-        con = ldap.initialize(self._props.uri)
-        # Turning referrals off since they cause problems with MS Active Directory
-        # More info: https://www.python-ldap.org/faq.html#usage
-        con.set_option(ldap.OPT_REFERRALS,0)
+        if self._auth_pool is not None:
+            with self._auth_pool.connection() as con:
+                return self._check_credentials(con, dn, pw)
+        con = self._communicator._connector.connect(bind=False)
+        try:
+            return self._check_credentials(con, dn, pw)
+        finally:
+            con.unbind_s()
+
+    def _check_credentials(self, con, dn, pw):
         try:
             con.simple_bind_s(dn, pw)
         except (ldap.INVALID_CREDENTIALS, ldap.UNWILLING_TO_PERFORM):
@@ -108,15 +243,220 @@ class LDAPSession(object):
         """
         self.ensure_connection()
         result = self._communicator.modify(dn, data)
+        self._reset_missing()
+        self._replica_update(dn)
         return result
 
     def delete(self, dn):
+        self.ensure_connection()
         self._communicator.delete(dn)
+        self._reset_missing()
+        self._replica_update(dn)
 
     def passwd(self, userdn, oldpw, newpw):
         self.ensure_connection()
         result = self._communicator.passwd(userdn, oldpw, newpw)
+        self._replica_update(userdn)
         return result
 
+    def write_many(self, operations):
+        """Perform several write operations at once. See
+        ``node.ext.ldap.base.LDAPCommunicator.write_many``.
+        """
+        self.ensure_connection()
+        errors = self._communicator.write_many(operations)
+        self._reset_missing()
+        for (action, dn, data), error in zip(operations, errors):
+            if error is None:
+                self._replica_update(dn)
+        return errors
+
+    def invalidate(self, dn):
+        """Evict cached searches and missing keys possibly affected by a
+        change of entry with ``dn`` made by another client, e.g. notified by
+        ``node.ext.ldap.sync.LDAPChangeListener``.
+        """
+        self._communicator._cache_invalidate(dn)
+        self._reset_missing()
+
+    def _reset_missing(self):
+        # writes may create keys marked missing
+        if self._negative_cache is not None:
+            self._negative_cache.reset()
+
     def unbind(self):
-        self._communicator.unbind()
+        if self._communicator.bound:
+            self._communicator.unbind()
+        if self._auth_pool is not None:
+            self._auth_pool.close()
+            self._auth_pool = self._communicator._connector.auth_pool()
+
+
+class LDAPAsyncSession(object):
+    """LDAP Session performing operations asynchronously on one connection.
+
+    Operations are submitted without waiting for the server and return the
+    LDAP message id. Many operations can be in flight at a time. Results are
+    collected with ``poll``, which never blocks, and fetched with ``result``.
+
+    To integrate with an event loop, watch ``fileno`` for readability and call
+    ``poll`` when the connection became readable.
+
+    The session is not thread safe, use it from one thread only.
+
+    all strings must be utf8 encoded!
+    """
+
+    def __init__(self, props):
+        self._props = props
+        self._connector = LDAPConnector(props=props)
+        self._con = None
+        self.baseDN = ''
+        # msgid -> operation type of operations in flight
+        self._pending = dict()
+        # msgid -> (result, error) of completed operations
+        self._done = dict()
+
+    def bind(self):
+        if self._con is None:
+            self._con = self._connector.connect()
+
+    def unbind(self):
+        if self._con is None:
+            return
+        self._con.unbind_s()
+        self._con = None
+        self._pending.clear()
+        self._done.clear()
+
+    def fileno(self):
+        """File descriptor of the underlying connection.
+        """
+        self.bind()
+        return self._con.fileno()
+
+    @property
+    def pending(self):
+        """Message ids of operations in flight.
+        """
+        return sorted(self._pending.keys())
+
+    def search(self, queryFilter='(objectClass=*)', scope=BASE, baseDN=None,
+               attrlist=None, attrsonly=0):
+        """Submit search and return message id.
+        """
+        if not queryFilter:
+            queryFilter = '(objectClass=*)'
+        if baseDN is None:
+            baseDN = self.baseDN
+            if not baseDN:
+                raise ValueError(u"baseDN unset.")
+        if type(attrlist) in (list, tuple):
+            attrlist = [str(_) for _ in attrlist]
+        self.bind()
+        msgid = self._con.search_ext(
+            baseDN, scope, queryFilter, attrlist, attrsonly)
+        return self._submitted(msgid, 'search')
+
+    def add(self, dn, data):
+        """Submit adding of an entry and return message id.
+        """
+        self.bind()
+        attributes = [(k, v) for k, v in data.items()]
+        return self._submitted(self._con.add_ext(dn, attributes), 'add')
+
+    def modify(self, dn, modlist):
+        """Submit modification of an entry and return message id.
+        """
+        self.bind()
+        return self._submitted(self._con.modify_ext(dn, modlist), 'modify')
+
+    def delete(self, dn):
+        """Submit deletion of an entry and return message id.
+        """
+        self.bind()
+        return self._submitted(self._con.delete_ext(dn), 'delete')
+
+    def passwd(self, userdn, oldpw, newpw):
+        """Submit password change and return message id.
+        """
+        self.bind()
+        msgid = self._con.passwd(userdn, oldpw, newpw)
+        return self._submitted(msgid, 'passwd')
+
+    def poll(self):
+        """Collect responses available without blocking.
+
+        Return list of message ids of completed operations.
+        """
+        completed = list()
+        for msgid in self.pending:
+            if self._receive(msgid, 0):
+                completed.append(msgid)
+        return completed
+
+    def done(self, msgid):
+        """Return whether operation with message id has been completed.
+        """
+        if msgid in self._done:
+            return True
+        if msgid not in self._pending:
+            raise KeyError(msgid)
+        return self._receive(msgid, 0)
+
+    def result(self, msgid, timeout=None):
+        """Return result of operation with message id.
+
+        Waits until the operation completed. If ``timeout`` is given and the
+        operation does not complete in time, ``ldap.TIMEOUT`` is raised.
+        Errors of the operation are raised here.
+
+        Returns list of entries for searches, otherwise None.
+        """
+        if msgid not in self._done:
+            if msgid not in self._pending:
+                raise KeyError(msgid)
+            if timeout is None:
+                timeout = -1
+            if not self._receive(msgid, timeout):
+                raise ldap.TIMEOUT(
+                    {'desc': 'Operation {0} timed out'.format(msgid)})
+        result, error = self._done.pop(msgid)
+        if error is not None:
+            raise error
+        return result
+
+    def abandon(self, msgid):
+        """Abandon operation with message id.
+        """
+        if msgid in self._pending:
+            del self._pending[msgid]
+            self._con.abandon(msgid)
+        self._done.pop(msgid, None)
+
+    def _submitted(self, msgid, operation):
+        self._pending[msgid] = operation
+        return msgid
+
+    def _receive(self, msgid, timeout):
+        # try to receive complete response for msgid, return whether done
+        try:
+            rtype, data, rmsgid, rctrls = self._con.result3(
+                msgid, all=1, timeout=timeout)
+        except ldap.TIMEOUT:
+            return False
+        except ldap.LDAPError, error:
+            del self._pending[msgid]
+            self._done[msgid] = (None, error)
+            return True
+        if rtype is None:
+            # nothing received yet
+            return False
+        operation = self._pending.pop(msgid)
+        result = None
+        if operation == 'search':
+            # ActiveDirectory returns entries with dn None, which can be
+            # ignored
+            result = [entry for entry in data if entry[0] is not None]
+        self._done[msgid] = (result, None)
+        return True
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+from ldap.ldapobject import SimpleLDAPObject
+from ldap.syncrepl import SyncreplConsumer
+from node.ext.ldap.base import LDAPConnector
+from node.ext.ldap.cache import _explode_dn
+from node.ext.ldap.scope import SUBTREE
+from node.utils import decode
+import ldap
+import logging
+import threading
+
+
+logger = logging.getLogger('node.ext.ldap')
+
+
+class SyncreplConnection(SimpleLDAPObject, SyncreplConsumer):
+    """LDAP connection consuming syncrepl content updates.
+
+    Updates are passed to ``listener``.
+    """
+    listener = None
+
+    def syncrepl_get_cookie(self):
+        return self.listener.cookie
+
+    def syncrepl_set_cookie(self, cookie):
+        self.listener.cookie = cookie
+
+    def syncrepl_entry(self, dn, attrs, uuid):
+        self.listener.entry(dn, uuid)
+
+    def syncrepl_delete(self, uuids):
+        self.listener.delete(uuids)
+
+    def syncrepl_present(self, uuids, refreshDeletes=False):
+        self.listener.present(uuids, refreshDeletes)
+
+    def syncrepl_refreshdone(self):
+        self.listener.refreshdone()
+
+
+class LDAPChangeListener(object):
+    """Listen for changes in the directory.
+
+    Uses the content synchronization operation (syncrepl, RFC 4533) in
+    refreshAndPersist mode in a background thread. The server needs to
+    provide it, e.g. OpenLDAP with ``syncprov`` overlay.
+
+    Subscribers get called with the DN of each added, modified or deleted
+    entry. They are called from the listener thread.
+    """
+
+    def __init__(self, props, baseDN, scope=SUBTREE,
+                 queryFilter='(objectClass=*)', poll_timeout=1.0,
+                 reconnect_delay=10.0):
+        """
+        props
+            ``LDAPProps`` instance.
+
+        baseDN
+            Base DN of the observed subtree.
+
+        scope
+            Scope of the observed subtree.
+
+        queryFilter
+            Only entries matching this filter are observed.
+
+        poll_timeout
+            Seconds to wait for changes before checking whether the listener
+            has been stopped.
+
+        reconnect_delay
+            Seconds to wait before reconnecting if the connection failed.
+        """
+        self.baseDN = baseDN
+        self.scope = scope
+        self.queryFilter = queryFilter
+        self.poll_timeout = poll_timeout
+        self.reconnect_delay = reconnect_delay
+        self.cookie = None
+        self._connector = LDAPConnector(props=props)
+        self._subscribers = list()
+        # entry UUID -> DN
+        self._uuids = dict()
+        # UUIDs presented during refresh phase
+        self._present = set()
+        # whether changes during refresh phase get notified. False on initial
+        # synchronization, where all entries are sent.
+        self._notify_refresh = False
+        self._refreshing = True
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def subscribe(self, callback):
+        """Register callback, gets called with DN of changed entries.
+        """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start listening in background thread.
+        """
+        if self.running:
+            raise RuntimeError(u"Listener already running.")
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop listening and wait for background thread to terminate.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def entry(self, dn, uuid):
+        """Entry added or modified.
+        """
+        old_dn = self._uuids.get(uuid)
+        self._uuids[uuid] = dn
+        if self._refreshing:
+            self._present.add(uuid)
+            if not self._notify_refresh:
+                return
+        if old_dn is not None and old_dn != dn:
+            # entry has been renamed
+            self._notify(old_dn)
+        self._notify(dn)
+
+    def delete(self, uuids):
+        """Entries deleted.
+        """
+        for uuid in uuids:
+            dn = self._uuids.pop(uuid, None)
+            if dn is not None:
+                self._notify(dn)
+
+    def present(self, uuids, refreshDeletes=False):
+        """Entries unchanged, or end of presentation if ``uuids`` is None.
+        """
+        if uuids is not None:
+            self._present.update(uuids)
+            return
+        if not refreshDeletes:
+            # entries not presented have been deleted
+            deleted = [
+                uuid for uuid in self._uuids if uuid not in self._present
+            ]
+            self.delete(deleted)
+        self._present = set()
+
+    def refreshdone(self):
+        """Refresh phase done, persist phase follows.
+        """
+        self._refreshing = False
+        self._present = set()
+
+    def _notify(self, dn):
+        for callback in self._subscribers:
+            try:
+                callback(dn)
+            except Exception:
+                logger.exception(u"Change listener callback failed.")
+
+    def _run(self):
+        while not self._stopped.is_set():
+            con = None
+            try:
+                con = self._connector.connect(
+                    ldapobject_class=SyncreplConnection)
+                con.listener = self
+                # changes during refresh phase get notified if continuing
+                # from a previous synchronization state
+                self._notify_refresh = self.cookie is not None
+                self._refreshing = True
+                msgid = con.syncrepl_search(
+                    self.baseDN,
+                    self.scope,
+                    mode='refreshAndPersist',
+                    filterstr=self.queryFilter,
+                    attrlist=['1.1'],
+                )
+                while not self._stopped.is_set():
+                    try:
+                        if not con.syncrepl_poll(
+                                msgid=msgid, timeout=self.poll_timeout):
+                            break
+                    except ldap.TIMEOUT:
+                        continue
+            except ldap.LDAPError:
+                logger.exception(u"Change listener connection failed.")
+                self._stopped.wait(self.reconnect_delay)
+            finally:
+                if con is not None:
+                    try:
+                        con.unbind_s()
+                    except ldap.LDAPError:
+                        pass
+
+
+class LDAPNodeInvalidator(object):
+    """Change listener callback invalidating loaded nodes of a tree.
+
+    Nodes are not thread safe, thus changes are queued and get applied by
+    calling ``apply`` from the thread working with the tree. Changed nodes
+    are not invalidated. Changes of the root entry reload its attributes.
+    """
+
+    def __init__(self, node):
+        self.root = node.root
+        self._dns = list()
+        self._lock = threading.Lock()
+
+    def __call__(self, dn):
+        with self._lock:
+            self._dns.append(dn)
+
+    def apply(self):
+        """Invalidate nodes changed in the directory since last call.
+        """
+        with self._lock:
+            dns, self._dns = self._dns, list()
+        root_rdns = _explode_dn(self.root.DN.encode('utf-8'))
+        # normalized RDN -> key maps of nodes, built once per call if needed
+        keys = dict()
+        for dn in dns:
+            rdns = _explode_dn(dn)
+            depth = len(rdns) - len(root_rdns)
+            if depth < 0 or rdns[depth:] != root_rdns:
+                # outside of tree
+                continue
+            if depth == 0:
+                self._reload_root()
+                continue
+            try:
+                raw_rdns = ldap.dn.explode_dn(dn)
+            except ldap.LDAPError:
+                raw_rdns = [rdn.strip() for rdn in dn.split(',')]
+            node = self.root
+            for i in range(depth - 1, 0, -1):
+                key = self._key(node, raw_rdns[i], rdns[i], keys)
+                if key is None:
+                    # not loaded, nothing to invalidate
+                    node = None
+                    break
+                node = node.storage[key]
+            if node is None:
+                continue
+            key = self._key(node, raw_rdns[0], rdns[0], keys)
+            if key is None:
+                continue
+            try:
+                node.invalidate(key)
+            except RuntimeError:
+                logger.warning(
+                    u"Changed node '%s' not invalidated." % (key,))
+            keys.pop(id(node), None)
+
+    def _reload_root(self):
+        # reload attributes of root if loaded
+        root = self.root
+        nodespaces = root._nodespaces
+        if not nodespaces or '__attrs__' not in nodespaces:
+            return
+        attrs = nodespaces['__attrs__']
+        if attrs.changed:
+            logger.warning(
+                u"Changed node '%s' not invalidated." % (root.name,))
+            return
+        attrs.load()
+
+    def _key(self, node, raw_rdn, rdn, keys):
+        # key of loaded child by RDN as contained in DN or normalized RDN
+        key = decode(raw_rdn)
+        if key in node.storage:
+            return key
+        # RDN differs from key, e.g. by case. Look up by normalized RDN.
+        node_keys = keys.get(id(node))
+        if node_keys is None:
+            node_keys = keys[id(node)] = dict(
+                (_explode_dn(key.encode('utf-8'))[0], key)
+                for key in node.storage
+            )
+        return node_keys.get(rdn)
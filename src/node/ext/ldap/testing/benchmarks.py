@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""Micro benchmarks for performance relevant code paths.
+
+Run with::
+
+    python -m node.ext.ldap.testing.benchmarks
+
+No LDAP server is required, but the ``test`` extra must be installed since
+``node.ext.ldap.testing`` depends on ``plone.testing``.
+"""
+from node.ext.ldap import LDAPCommunicator
+from node.ext.ldap import LDAPConnector
+from node.ext.ldap import LDAPProps
+from node.ext.ldap import LDAPDictFilter
+from node.ext.ldap import LDAPNode
+from node.ext.ldap import LDAPReadOnlyNode
+from node.ext.ldap import filter as ldap_filter
+from node.ext.ldap.base import md5digest
+import sys
+import timeit
+
+
+def legacy_cache_key(communicator, baseDN, scope, queryFilter, attrlist,
+                     attrsonly, page_size=None, cookie=None):
+    # cache key scheme of node.ext.ldap <= 1.0b3
+    key_items = [
+        communicator._connector._bindDN,
+        baseDN,
+        sorted(attrlist or []),
+        attrsonly,
+        queryFilter,
+        scope,
+        page_size,
+        cookie
+    ]
+    key = '-'.join([str(_) for _ in key_items])
+    return md5digest(key)
+
+
+def bench_cache_keys(number=100000):
+    """Compare cache key schemes for a small BASE search.
+
+    Return list of ``(scheme, seconds)`` tuples for creating ``number`` keys.
+    """
+    props = LDAPProps(user='cn=Manager,dc=my-domain,dc=com', cache=False)
+    communicator = LDAPCommunicator(LDAPConnector(props))
+    args = (
+        'uid=user1,ou=users,dc=my-domain,dc=com',
+        0,
+        '(objectClass=*)',
+        [''],
+        0,
+    )
+
+    def legacy():
+        legacy_cache_key(communicator, *args)
+
+    def hashed():
+        communicator._cache_hashable_keys = False
+        communicator._cache_key(*args)
+
+    def tuple_key():
+        communicator._cache_hashable_keys = True
+        communicator._cache_key(*args)
+
+    return [
+        ('legacy md5 of joined strings', timeit.timeit(legacy, number=number)),
+        ('md5 of tuple key', timeit.timeit(hashed, number=number)),
+        ('tuple key', timeit.timeit(tuple_key, number=number)),
+    ]
+
+
+LEGACY_ESCAPE_CHARS = {
+    '(': '\\28',
+    ')': '\\29',
+    '/': '\\2f',
+    '\\': '\\5c',
+    '\x00': '\\00',
+}
+
+
+def legacy_dict_to_filter(criteria, or_search=False, or_keys=None,
+                          or_values=None):
+    # filter creation of node.ext.ldap <= 1.0b3. Every value wraps the
+    # filter created so far into a new string.
+    or_keys = (or_keys is None) and or_search or or_keys
+    or_values = (or_values is None) and or_search or or_values
+    _filter = ''
+    for attr, values in criteria.items():
+        if not isinstance(values, list):
+            values = [values]
+        attrfilter = ''
+        for value in values:
+            attr = ''.join(map(lambda x: LEGACY_ESCAPE_CHARS.get(x, x), attr))
+            value = ''.join(
+                map(lambda x: LEGACY_ESCAPE_CHARS.get(x, x), value))
+            valuefilter = '(%s=%s)' % (attr, value)
+            if not attrfilter:
+                attrfilter = valuefilter
+                continue
+            attrfilter = '(%s%s%s)' % (
+                or_values and '|' or '&', attrfilter, valuefilter)
+        if not _filter:
+            _filter = attrfilter
+            continue
+        _filter = '(%s%s%s)' % (or_keys and '|' or '&', _filter, attrfilter)
+    return _filter
+
+
+def bench_dict_filter(size=5000, number=20):
+    """Compare creation of OR filter for ``size`` member DN's.
+
+    Memoized filters are cleared before every run. Return list of
+    ``(scheme, seconds)`` tuples for creating ``number`` filters.
+    """
+    criteria = {
+        'member': [
+            'uid=user%i,ou=users,dc=my-domain,dc=com' % i
+            for i in range(size)
+        ],
+    }
+
+    def legacy():
+        legacy_dict_to_filter(criteria, or_search=True)
+
+    def flat():
+        ldap_filter._dict_filters.clear()
+        ldap_filter._composites.clear()
+        str(LDAPDictFilter(criteria, or_search=True))
+
+    def memoized():
+        str(LDAPDictFilter(criteria, or_search=True))
+
+    return [
+        ('legacy nested strings', timeit.timeit(legacy, number=number)),
+        ('flat filter node', timeit.timeit(flat, number=number)),
+        ('memoized filter', timeit.timeit(memoized, number=number)),
+    ]
+
+
+def deep_size(obj, exclude=()):
+    """Return approximate size in bytes of ``obj`` and all objects reachable
+    from it via containers, instance dicts and slots, except objects in
+    ``exclude`` and classes.
+    """
+    seen = set([id(_) for _ in exclude])
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, type):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        if hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+        for cls in type(obj).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                if hasattr(obj, name):
+                    stack.append(getattr(obj, name))
+    return size
+
+
+def bench_node_memory(size=10000):
+    """Compare memory used by ``size`` child nodes with loaded attributes.
+
+    Children get created from prefetched attributes like while iterating a
+    node with ``prefetch`` enabled. Return list of ``(node class, bytes per
+    node)`` tuples.
+    """
+    props = LDAPProps(cache=False)
+    results = list()
+    for factory in (LDAPNode, LDAPReadOnlyNode):
+        users = LDAPNode('ou=users,dc=my-domain,dc=com', props)
+        users.child_factory = factory
+        for i in range(size):
+            uid = 'user%i' % i
+            users._create_prefetched_child(
+                u'uid=%s' % uid,
+                'uid=%s,ou=users,dc=my-domain,dc=com' % uid,
+                {
+                    'objectClass': ['top', 'person', 'inetOrgPerson'],
+                    'uid': [uid],
+                    'cn': [uid],
+                    'sn': [uid],
+                    'mail': ['%s@my-domain.com' % uid],
+                })
+        children = users.storage.values()
+        for child in children:
+            child.attrs
+        total = deep_size(children, exclude=(users, users.ldap_session))
+        total -= sys.getsizeof(children)
+        results.append((factory.__name__, total / size))
+    return results
+
+
+def report(title, results, format='%8.3fs'):
+    print title
+    print '-' * len(title)
+    for name, value in results:
+        print ('%-40s ' + format) % (name, value)
+    print
+
+
+def main():
+    report('Cache keys (100000 keys)', bench_cache_keys())
+    report('OR filter of 5000 values (20 filters)',
+           bench_dict_filter())
+    report('Child nodes with loaded attributes (10000 nodes)',
+           bench_node_memory(), format='%8i bytes per node')
+
+
+if __name__ == '__main__':
+    main()                                                  # pragma NO COVERAGE
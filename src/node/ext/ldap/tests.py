@@ -11,7 +11,10 @@ DOCFILES = [
     ('cache.rst', testing.LDIF_data),
     ('base.rst', testing.LDIF_data),
     ('session.rst', testing.LDIF_data),
+    ('pool.rst', testing.LDIF_data),
     ('filter.rst', testing.LDIF_data),
+    ('sync.rst', testing.LDIF_data),
+    ('replica.rst', testing.LDIF_data),
     ('_node.rst', testing.LDIF_data),
     ('schema.rst', testing.LDIF_data),
     ('ugm/principals.rst', testing.LDIF_principals),
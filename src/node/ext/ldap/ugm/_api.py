@@ -46,6 +46,9 @@ FORMAT_UID = 1
 EXPIRATION_DAYS = 0
 EXPIRATION_SECONDS = 1
 
+# maximum number of searches pipelined at once on a single connection
+PIPELINE_BATCH_SIZE = 50
+
 
 class AccountExpired(object):
 
@@ -278,11 +281,7 @@ class LDAPGroupMapping(Behavior):
             val = self.related_principals(key)[key].context.DN
         elif self._member_format == FORMAT_UID:
             val = key
-        # self.context.attrs[self._member_attribute].remove won't work here
-        # issue in LDAPNodeAttributes, does not recognize changed this way.
-        members = self.context.attrs[self._member_attribute]
-        members.remove(val)
-        self.context.attrs[self._member_attribute] = members
+        self.context.attrs.remove_value(self._member_attribute, val)
         # XXX: call here immediately?
         self.context()
 
@@ -304,10 +303,7 @@ class LDAPGroupMapping(Behavior):
         key = decode_utf8(key)
         if key not in self.member_ids:
             val = self.translate_key(key)
-            # self.context.attrs[self._member_attribute].append won't work here
-            # issue in LDAPNodeAttributes, does not recognize changed this way.
-            old = self.context.attrs.get(self._member_attribute, list())
-            self.context.attrs[self._member_attribute] = old + [val]
+            self.context.attrs.add_value(self._member_attribute, val)
             # XXX: call here immediately?
             # self.context()
 
@@ -372,14 +368,8 @@ class LDAPGroup(LDAPGroupMapping, LDAPPrincipal, UgmGroup):
         if self._member_format != FORMAT_DN:
             return members
         principals = self.related_principals()
-        translated = list()
-        for dn in members:
-            try:
-                translated.append(principals.idbydn(dn))
-            except KeyError:
-                # inexistent DN
-                pass
-        return translated
+        # inexistent DN's are skipped
+        return principals.ids_by_dns(members)
 
     @default
     def translate_key(self, key):
@@ -454,6 +444,34 @@ class LDAPPrincipals(OdictStorage):
         except ldap.NO_SUCH_OBJECT:
             raise KeyError(dn)
 
+    @default
+    def ids_by_dns(self, dns):
+        """Return principal ids for given dns.
+
+        Searches get pipelined on a single connection in batches of
+        ``PIPELINE_BATCH_SIZE``. Inexistent dns are skipped.
+        """
+        session = self.context.ldap_session
+        dns = list(dns)
+        chunk_size = PIPELINE_BATCH_SIZE
+        ids = list()
+        for i in range(0, len(dns), chunk_size):
+            queries = [{
+                'baseDN': dn.encode('utf-8'),
+                'attrlist': [self._key_attr],
+            } for dn in dns[i:i + chunk_size]]
+            for res in session.search_many(queries):
+                if isinstance(res, ldap.NO_SUCH_OBJECT):
+                    continue
+                if isinstance(res, Exception):
+                    raise res
+                try:
+                    ids.append(res[0][1][self._key_attr][0].decode('utf-8'))
+                except (IndexError, KeyError):
+                    # entry without key attribute
+                    pass
+        return ids
+
     @override
     @property
     def ids(self):
@@ -474,10 +492,15 @@ class LDAPPrincipals(OdictStorage):
         try:
             return self.storage[key]
         except KeyError:
+            session = self.context.ldap_session
+            missing_key = ('principal', self.context.DN, key)
+            if session.missing(missing_key):
+                raise KeyError(key)
             criteria = {self._key_attr: key}
             attrlist = ['rdn', self._key_attr]
             res = self.context.search(criteria=criteria, attrlist=attrlist)
             if not res:
+                session.set_missing(missing_key)
                 raise KeyError(key)
             if len(res) > 1:
                 msg = u'More than one principal with id "{0}" found.'
@@ -894,18 +917,10 @@ class LDAPRole(LDAPGroupMapping, AliasedPrincipal):
             ugm = self.parent.parent
             users = ugm.users
             groups = ugm.groups
-            user_members = list()
-            for dn in members:
-                try:
-                    user_members.append(users.idbydn(dn, True))
-                except KeyError:
-                    pass
-            group_members = list()
-            for dn in members:
-                try:
-                    group_members.append('group:%s' % groups.idbydn(dn, True))
-                except KeyError:
-                    pass
+            user_members = users.ids_by_dns(members)
+            group_members = [
+                'group:%s' % id for id in groups.ids_by_dns(members)
+            ]
             members = user_members + group_members
         return members
 
@@ -950,11 +965,7 @@ class LDAPRole(LDAPGroupMapping, AliasedPrincipal):
             val = principals[real_key].context.DN
         elif self._member_format == FORMAT_UID:
             val = key
-        # self.context.attrs[self._member_attribute].remove won't work here
-        # issue in LDAPNodeAttributes, does not recognize changed this way.
-        members = self.context.attrs[self._member_attribute]
-        members.remove(val)
-        self.context.attrs[self._member_attribute] = members
+        self.context.attrs.remove_value(self._member_attribute, val)
         # XXX: call here immediately?
         self.context()
 